@@ -1 +1 @@
-from .algo import to_ascii
+from .algo import LayoutCache, LayoutSession, RenderCache, iter_ascii, to_ascii, write_ascii
@@ -1 +1,4 @@
-from .tsm import to_ascii
+from .tsm import iter_ascii, to_ascii, write_ascii
+from .cache import RenderCache
+from .layout_cache import LayoutCache
+from .session import LayoutSession
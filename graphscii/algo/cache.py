@@ -0,0 +1,90 @@
+import collections
+import hashlib
+import os
+import tempfile
+
+import networkx as nx
+
+CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'disk_hits', 'misses', 'maxsize', 'currsize'])
+
+
+def component_key(component: nx.Graph, with_labels=False, charset='heavy', contract=False):
+    """
+    Content hash of everything the drawing of a component depends on: its adjacency, in iteration order since the
+    layout follows it, the vertex labels when they are drawn, the charset and whether chains are contracted.
+    Node objects themselves are replaced by their index, so relabelled copies of the same graph share a key when
+    labels are not drawn.
+    """
+    index = {v: i for i, v in enumerate(component.nodes())}
+    h = hashlib.sha256()
+    h.update(repr((with_labels, charset, contract, len(index))).encode())
+    for v, nbrs in component.adj.items():
+        h.update(repr([index[u] for u in nbrs]).encode())
+    if with_labels:
+        h.update(repr([str(v) for v in index]).encode())
+    return h.hexdigest()
+
+
+class RenderCache:
+    """
+    Rendered components by component_key, the most recent maxsize kept in memory. With a path, entries are also
+    written to one file each under that directory, so processes sharing it reuse each other's renders; files are
+    written to a temporary name and renamed into place, so readers never see half an entry. The disk tier is never
+    evicted.
+    """
+
+    def __init__(self, maxsize=128, path=None):
+        if maxsize is not None and maxsize < 0:
+            raise ValueError(f"maxsize must be non negative, got {maxsize}")
+        self.maxsize = maxsize
+        self.path = path
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def get(self, key):
+        """the cached drawing, or None"""
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        if self.path is not None:
+            try:
+                with open(os.path.join(self.path, key + '.txt'), encoding='utf-8', newline='') as f:
+                    text = f.read()
+            except FileNotFoundError:
+                pass
+            else:
+                self.hits += 1
+                self.disk_hits += 1
+                self.remember(key, text)
+                return text
+        self.misses += 1
+        return None
+
+    def put(self, key, text):
+        self.remember(key, text)
+        if self.path is not None:
+            fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+                f.write(text)
+            os.replace(tmp, os.path.join(self.path, key + '.txt'))
+
+    def remember(self, key, text):
+        if self.maxsize == 0:
+            return
+        self.entries[key] = text
+        self.entries.move_to_end(key)
+        if self.maxsize is not None and len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """drops the in memory entries and resets the counters, the disk tier is left alone"""
+        self.entries.clear()
+        self.hits = self.disk_hits = self.misses = 0
+
+    def info(self):
+        return CacheInfo(self.hits, self.disk_hits, self.misses, self.maxsize, len(self.entries))
@@ -1,13 +1,28 @@
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import Executor
 
 import networkx as nx
+import numpy as np
 
+from .flow_solver import FlowModel, InfeasibleFlow, NetworkSimplex
 from .rectangularize import Rectangularize
+from .utils import Kind, v_is_vertex
 
 
 class Compaction:
-    def __init__(self, rectangularize: Rectangularize, with_labels=False):
+    def __init__(self, rectangularize: Rectangularize, with_labels=False, method='flow', executor: Executor = None,
+                 warm_start=None):
+        """
+        method is 'flow' (min cost flow, minimizes the total edge length) or 'longest_path' (linear time).
+        With an executor (a process pool kept by the caller, as starting one costs more than either flow), the
+        horizontal flow is solved on it while the vertical one is solved here.
+        warm_start is the snapshot() of an earlier drawing of the same graph. The flows start out at the lengths of
+        the edges it shares with this one, so after a small edit only the pivots around it are left to make.
+        """
+        if method not in ('flow', 'longest_path'):
+            raise Exception(f"Unknown compaction method {method}")
         self.G = rectangularize.G
+        self.vertex_labels = rectangularize.vertex_labels
         self.side_dict = rectangularize.side_dict
         self.dcel = rectangularize.dcel
         self.triangle_faces = rectangularize.triangle_faces
@@ -15,24 +30,38 @@ class Compaction:
         self.rect_edges = rectangularize.rect_edges
         self.bend_offsets = rectangularize.bend_offsets
         self.ori_edges = rectangularize.ori_edges
+        self.stable_keys = rectangularize.stable_keys()
+        self.warm_start = warm_start
 
-        if with_labels:
-            max_label_w = max(len(str(label[1])) for label in self.G.nodes())
-        else:
-            max_label_w = 0
-
-        self.v_w = max(max([abs(coord[0]) for _, coord in self.bend_offsets.items()]) + 1, max_label_w // 2 + 1)
-        self.v_h = max([abs(coord[1]) for _, coord in self.bend_offsets.items()]) + 1
+        self.v_w, self.v_h = vertex_size(rectangularize, with_labels)
         self.e_w = 4
         self.e_h = 1
+        self.executor = executor
 
-        self.length_dict = self.tidy_rectangle_compaction()
+        if method == 'longest_path':
+            self.length_dict = self.longest_path_compaction()
+        else:
+            self.length_dict = self.tidy_rectangle_compaction()
         self.pos = self.layout()
         self.apply_bend_offsets()
 
+    def label(self, v):
+        """text drawn for v, the user's label for vertices"""
+        return node_label(self.vertex_labels, v)
+
+    def snapshot(self):
+        """length of every edge by the stable keys of its ends, see Rectangularize.stable_keys"""
+        keys = self.stable_keys
+        lengths = {}
+        for he, side in self.side_dict.items():
+            if side in (0, 1):
+                u, v = he.id
+                lengths[keys.get(u, u), keys.get(v, v)] = self.length_dict[he]
+        return lengths
+
     def tidy_rectangle_compaction(self):
-        def build_flow(target_side):
-            flow = nx.MultiDiGraph()
+        def build_arcs(target_side):
+            arcs = []
             for he, side in self.side_dict.items():
                 if side == target_side:
                     lf, rf = he.twin.inc, he.inc
@@ -40,23 +69,20 @@ class Compaction:
                     if he in self.triangle_edges or he.twin in self.triangle_edges:
                         continue
                     lf_id = lf.id
-                    rf_id = rf.id if not rf.is_external else ('face', 'end')
+                    rf_id = rf.id if not rf.is_external else (Kind.FACE, 'end')
                     # for each side with a vertex, add 2?
                     lb = (2 * self.v_w + self.e_w) if target_side % 2 == 1 else (2 * self.v_h + self.e_h)
-                    flow.add_edge(lf_id, rf_id, key=he.id, lowerbound=lb, cost=1, capacity=2 ** 32)
-            flow.add_edge(self.dcel.ext_face.id, ('face', 'end'), key='extend_edge', lowerbound=0, cost=0,
-                          capacity=2 ** 32)
-            for node in flow.nodes():
-                flow.nodes[node]['demand'] = 0
-            flow.nodes[self.dcel.ext_face.id]['demand'] = -2 ** 32
-            flow.nodes[('face', 'end')]['demand'] = 2 ** 32
-            return flow
-
-        def min_cost_flow(flow):
-            def get_demand(flow_dict, node):
-                in_flow = sum(flow_dict[u][v][key] for u, v, key in flow.in_edges(node, keys=True))
-                out_flow = sum(flow_dict[u][v][key] for u, v, key in flow.out_edges(node, keys=True))
-                if in_flow == 0 and node != ('face', -1):
+                    arcs.append((lf_id, rf_id, he.id, lb))
+            return arcs
+
+        def check_arcs(arcs):
+            """every face must have lower bounded flow both coming in and going out"""
+            in_flow, out_flow = defaultdict(int), defaultdict(int)
+            for u, v, _, lb in arcs:
+                out_flow[u] += lb
+                in_flow[v] += lb
+            for node in dict.fromkeys([self.dcel.ext_face.id, *out_flow, *in_flow]):
+                if in_flow[node] == 0 and node != (Kind.FACE, -1):
                     print('inflow 0', node)
                     print(
                         f"bad face:{[(he, he in self.triangle_edges or he.twin in self.triangle_edges, self.side_dict[he]) for he in self.dcel.faces[node].surround_half_edges()]}")
@@ -66,7 +92,7 @@ class Compaction:
                             f"face: {[(he, he in self.triangle_edges or he.twin in self.triangle_edges, self.side_dict[he]) for he in face.surround_half_edges()]}")
                     raise Exception(
                         "This should not happen, something went wrong during rectangularization. I think I know where this stems from, open a GH issue and I will get back to you.")
-                if out_flow == 0 and node != ('face', 'end'):
+                if out_flow[node] == 0 and node != (Kind.FACE, 'end'):
                     print('outflow 0', node)
                     print(
                         f"bad face:{[(he, he in self.triangle_edges or he.twin in self.triangle_edges, self.side_dict[he]) for he in self.dcel.faces[node].surround_half_edges()]}")
@@ -76,80 +102,191 @@ class Compaction:
                             f"face: {[(he, he in self.triangle_edges or he.twin in self.triangle_edges, self.side_dict[he]) for he in face.surround_half_edges()]}")
                     raise Exception(
                         "this should not happen, something went wrong during rectangularization. I think I know where this stems from, open a GH issue and I will get back to you.")
-                return in_flow - out_flow
 
-            def split():
-                base_dict = defaultdict(lambda: defaultdict(dict))
-                new_mdg = nx.MultiDiGraph()
+        hor_arcs = build_arcs(1)  # up -> bottom
+        ver_arcs = build_arcs(0)  # left -> right
+        check_arcs(hor_arcs)
+        check_arcs(ver_arcs)
 
-                for u, v, key in flow.edges:
-                    lowerbound = flow[u][v][key]['lowerbound']
-                    base_dict[u][v][key] = lowerbound
-                    new_mdg.add_edge(u, v, key, capacity=flow[u][v][key]['capacity'] - lowerbound,
-                                     weight=flow[u][v][key]['cost'], )
-                for node in flow:
-                    new_mdg.nodes[node]['demand'] = flow.nodes[node]['demand'] - get_demand(base_dict, node)
-                return base_dict, new_mdg
+        def warm_lengths(arcs):
+            if self.warm_start is None:
+                return None
+            keys = self.stable_keys
+            return [self.warm_start.get((keys.get(u, u), keys.get(v, v))) for _, _, (u, v), _ in arcs]
 
-            base_dict, new_mdg = split()
-            flow_dict = nx.min_cost_flow(new_mdg)
-            for u, v, key in flow.edges:
-                flow_dict[u][v][key] += base_dict[u][v][key]
+        source = self.dcel.ext_face.id
+        hor_warm, ver_warm = warm_lengths(hor_arcs), warm_lengths(ver_arcs)
+        if self.executor is not None:
+            # both solvers hold the gil while solving, so the horizontal flow goes to another process
+            hor_future = self.executor.submit(solve_compaction_flow, hor_arcs, source, hor_warm)
+            ver_length = solve_compaction_flow(ver_arcs, source, ver_warm)
+            hor_length = hor_future.result()
+        else:
+            hor_length = solve_compaction_flow(hor_arcs, source, hor_warm)
+            ver_length = solve_compaction_flow(ver_arcs, source, ver_warm)
 
-            return flow_dict
+        halfedge_length = {}
 
-        hor_flow = build_flow(1)  # up -> bottom
-        ver_flow = build_flow(0)  # left -> right
+        for he, side in self.side_dict.items():
+            if side in (0, 1):
+                lengths = ver_length if side == 0 else hor_length
+                length = lengths[he.id] if he not in self.triangle_edges else 0
+                halfedge_length[he] = length
+                halfedge_length[he.twin] = length
 
-        hor_flow_dict = min_cost_flow(hor_flow)
-        ver_flow_dict = min_cost_flow(ver_flow)
+        return halfedge_length
 
+    def longest_path_compaction(self):
+        """
+        Every face is a rectangle after rectangularization, so edge lengths can also be read off coordinates. Vertices
+        joined by edges perpendicular to an axis (or by zero length triangle edges) share a coordinate on it, and the
+        edges along the axis order these segments into a dag. A topological longest path pass gives every segment its
+        smallest coordinate, and every edge its length as a difference. This minimizes width and height rather than
+        the total edge length.
+        """
         halfedge_length = {}
+        for target_side, lb in ((1, 2 * self.v_w + self.e_w), (0, 2 * self.v_h + self.e_h)):
+            coord = self.longest_path(target_side, lb)
+            for he, side in self.side_dict.items():
+                if side == target_side:
+                    length = coord[he.twin.ori.id] - coord[he.ori.id]
+                    halfedge_length[he] = length
+                    halfedge_length[he.twin] = length
+
+        return halfedge_length
+
+    def longest_path(self, target_side, lb):
+        """coordinate of every vertex along the axis of target_side (1: x, 0: y)"""
+        parent = {v: v for v in self.dcel.vertices}
+
+        def find(v):
+            while parent[v] != v:
+                parent[v] = parent[parent[v]]
+                v = parent[v]
+            return v
 
         for he, side in self.side_dict.items():
-            if side in (0, 1):
-                rf = he.inc
-                rf_id = ('face', 'end') if rf.is_external else rf.id
-                lf_id = he.twin.inc.id
+            if side % 2 != target_side % 2 or he in self.triangle_edges:
+                parent[find(he.ori.id)] = find(he.twin.ori.id)
 
-                if side == 0:
-                    hv_flow_dict = ver_flow_dict
-                else:
-                    hv_flow_dict = hor_flow_dict
+        succ = defaultdict(list)
+        in_deg = defaultdict(int)
+        for he, side in self.side_dict.items():
+            if side == target_side and he not in self.triangle_edges:
+                u, v = find(he.ori.id), find(he.twin.ori.id)
+                succ[u].append(v)
+                in_deg[v] += 1
 
-                length = hv_flow_dict[lf_id][rf_id][he.id] if he not in self.triangle_edges else 0
-                halfedge_length[he] = length
-                halfedge_length[he.twin] = length
+        segments = {find(v) for v in self.dcel.vertices}
+        coord = dict.fromkeys(segments, 0)
+        queue = deque(seg for seg in segments if in_deg[seg] == 0)
+        done = 0
+        while queue:
+            u = queue.popleft()
+            done += 1
+            for v in succ[u]:
+                coord[v] = max(coord[v], coord[u] + lb)
+                in_deg[v] -= 1
+                if in_deg[v] == 0:
+                    queue.append(v)
+        if done != len(segments):
+            raise Exception("Compaction constraints are cyclic, something went wrong during rectangularization")
 
-        return halfedge_length
+        return {v: coord[find(v)] for v in self.dcel.vertices}
 
     def layout(self):
-        """ return pos of self.G"""
-        pos = {}
-
-        def set_coord(init_he, x, y):
-            for he in init_he.traverse():
-                pos[he.ori.id] = (x, y)
-                side = self.side_dict[he]
-                length = self.length_dict[he]
-                if side == 1:
-                    x += length
-                elif side == 3:
-                    x -= length
-                elif side == 0:
-                    y += length
-                else:
-                    y -= length
-
-            for he in init_he.traverse():
-                for e in he.ori.surround_half_edges():
-                    if e.twin.ori.id not in pos:
-                        set_coord(e, *pos[e.ori.id])
-
-        set_coord(self.dcel.ext_face.inc, 0, 0)
+        """ return pos of self.G, placing every vertex once in a bfs over the dcel"""
+        steps = {0: (0, 1), 1: (1, 0), 2: (0, -1), 3: (-1, 0)}
+        start = self.dcel.ext_face.inc.ori
+        pos = {start.id: (0, 0)}
+        queue = deque([start])
+        while queue:
+            vertex = queue.popleft()
+            x, y = pos[vertex.id]
+            for he in vertex.surround_half_edges():
+                other = he.twin.ori
+                if other.id not in pos:
+                    dx, dy = steps[self.side_dict[he]]
+                    length = self.length_dict[he]
+                    pos[other.id] = (x + dx * length, y + dy * length)
+                    queue.append(other)
         return pos
 
     def apply_bend_offsets(self):
-        for vertex in self.pos:
-            delta = self.bend_offsets.get(vertex, (0, 0))
-            self.pos[vertex] = self.pos[vertex][0] + delta[0], self.pos[vertex][1] + delta[1]
+        # pos_nodes and pos_array keep the final positions as an array too, for bulk passes like the bounding box
+        self.pos_nodes = list(self.pos)
+        self.pos_array = np.array(list(self.pos.values()), dtype=np.int64).reshape(-1, 2)
+        self.pos_array += np.array([self.bend_offsets.get(v, (0, 0)) for v in self.pos_nodes],
+                                   dtype=np.int64).reshape(-1, 2)
+        self.pos = dict(zip(self.pos_nodes, map(tuple, self.pos_array.tolist())))
+
+
+def node_label(vertex_labels, v):
+    return str(vertex_labels[v[1]] if v_is_vertex(v) else v[1])
+
+
+def vertex_size(rectangularize: Rectangularize, with_labels=False):
+    """half width and half height of the vertex boxes, room for the bends on every side and for the widest label"""
+    if with_labels:
+        max_label_w = max(len(node_label(rectangularize.vertex_labels, v)) for v in rectangularize.G.nodes())
+    else:
+        max_label_w = 0
+
+    v_w = max(max([abs(coord[0]) for _, coord in rectangularize.bend_offsets.items()]) + 1, max_label_w // 2 + 1)
+    v_h = max([abs(coord[1]) for _, coord in rectangularize.bend_offsets.items()]) + 1
+    return v_w, v_h
+
+
+def solve_compaction_flow(arcs, source, warm_start=None):
+    """
+    Min cost flow from source to (Kind.FACE, 'end') over arcs (left face, right face, key, lowerbound) of unit cost,
+    returns the flow of every key. Module level, so it can run in a worker process.
+    warm_start is a flow to start from for every arc (None for an arc it has none for), see solve_warm_compaction_flow.
+    """
+    if warm_start is not None:
+        return solve_warm_compaction_flow(arcs, source, warm_start)
+    flow = nx.MultiDiGraph()
+    for lf_id, rf_id, key, lb in arcs:
+        flow.add_edge(lf_id, rf_id, key=key, lowerbound=lb, cost=1)
+    flow.add_edge(source, (Kind.FACE, 'end'), key='extend_edge', lowerbound=0, cost=0)
+    demand = dict.fromkeys(flow.nodes(), 0)
+    demand[source] = -2 ** 32
+    demand[(Kind.FACE, 'end')] = 2 ** 32
+
+    # move the lower bounds out of the flow
+    new_mdg = nx.MultiDiGraph()
+    for u, v, key, data in flow.edges(keys=True, data=True):
+        new_mdg.add_edge(u, v, key, capacity=2 ** 32 - data['lowerbound'], weight=data['cost'])
+        demand[u] += data['lowerbound']
+        demand[v] -= data['lowerbound']
+    nx.set_node_attributes(new_mdg, demand, 'demand')
+
+    flow_dict = nx.min_cost_flow(new_mdg)
+    return {key: flow_dict[u][v][key] + lb for u, v, key, lb in flow.edges(keys=True, data='lowerbound')}
+
+
+def solve_warm_compaction_flow(arcs, source, warm_start):
+    """
+    The flow of solve_compaction_flow as a circulation on the network simplex: what reaches (Kind.FACE, 'end') goes back
+    to source for free, and lower bounds move into the demands. It starts out at the flow of warm_start, lower bounds
+    where it has none, so when that is the optimum of a similar network few pivots are left.
+    """
+    end = (Kind.FACE, 'end')
+    nodes = list(dict.fromkeys([source, end, *(u for u, *_ in arcs), *(v for _, v, *_ in arcs)]))
+    node_ind = {node: i for i, node in enumerate(nodes)}
+    tail = np.array([node_ind[u] for u, *_ in arcs] + [node_ind[end]], dtype=np.int64)
+    head = np.array([node_ind[v] for _, v, *_ in arcs] + [node_ind[source]], dtype=np.int64)
+    lb = np.array([lb for *_, lb in arcs] + [0], dtype=np.int64)
+    demand = np.bincount(tail, lb, len(nodes)) - np.bincount(head, lb, len(nodes))
+    model = FlowModel(nodes, [key for _, _, key, _ in arcs] + ['return'], tail, head, [1] * len(arcs) + [0],
+                      [2 ** 32] * (len(arcs) + 1), demand)
+
+    start = np.array([lb_ if length is None else length for length, lb_ in zip(warm_start, lb.tolist())] + [0]) - lb
+    start = np.maximum(start, 0)
+    # send back what the start leaves at the end
+    start[-1] = max(np.bincount(head, start, len(nodes))[node_ind[end]] - demand[node_ind[end]], 0)
+    ns = NetworkSimplex(model, start)
+    ns.optimize()
+    if not ns.feasible(()):
+        raise InfeasibleFlow("Compaction flow network is infeasible")
+    return dict(zip(model.arcs[:-1], (ns.flow()[:-1] + lb[:-1]).tolist()))
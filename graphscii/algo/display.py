@@ -1,89 +1,37 @@
+import collections
+from functools import cached_property
+
+import numpy as np
+
 from .compaction import Compaction
 from .utils import v_is_vertex, v_is_rect_dummy
 
 
-class BoxChar:
-    def __init__(self, val):
-        # val is 4 digit string (number between 0, 15 incl)
-        if not 0 <= val <= 15:
-            raise Exception("bad val")
-        self.val = val
-
-    def char(self):
-        match self.val:
-            case 0:
-                return ' '
-            case 1:
-                return '╹'
-            case 2:
-                return '╸'
-            case 3:
-                return '┛'
-            case 4:
-                return '╻'
-            case 5:
-                return '┃'
-            case 6:
-                return '┓'
-            case 7:
-                return '┫'
-            case 8:
-                return '╺'
-            case 9:
-                return '┗'
-            case 10:
-                return '━'
-            case 11:
-                return '┻'
-            case 12:
-                return '┏'
-            case 13:
-                return '┣'
-            case 14:
-                return '┳'
-            case 15:
-                return '╋'
-
-    @staticmethod
-    def l():
-        return BoxChar(2)
-
-    @staticmethod
-    def b():
-        return BoxChar(4)
-
-    @staticmethod
-    def r():
-        return BoxChar(8)
-
-    @staticmethod
-    def t():
-        return BoxChar(1)
-
-    @staticmethod
-    def tb():
-        return BoxChar.t() + BoxChar.b()
-
-    @staticmethod
-    def lr():
-        return BoxChar.l() + BoxChar.r()
-
-    def __add__(self, other):
-        return BoxChar(self.val | other.val)
-
-    def __iadd__(self, other):
-        return BoxChar(self.val | other.val)
-
-    def __sub__(self, other):
-        return BoxChar(self.val & ~other.val)
-
-    def __isub__(self, other):
-        return BoxChar(self.val & ~other.val)
+# glyph of every 4 bit direction mask (top 1, left 2, bottom 4, right 8)
+CHARSETS = {
+    'heavy': ' ╹╸┛╻┃┓┫╺┗━┻┏┣┳╋',
+    'light': ' ╵╴┘╷│┐┤╶└─┴┌├┬┼',
+    'double': ' ║═╝║║╗╣═╚═╩╔╠╦╬',
+    'ascii': ' |-+||++-+-+++++',
+}
+
+
+def get_charset(charset):
+    """Accepts the name of a charset in CHARSETS, or any 16 character string indexed by direction mask"""
+    if charset in CHARSETS:
+        return CHARSETS[charset]
+    if not isinstance(charset, str) or len(charset) != 16:
+        raise ValueError(f"Unknown charset {charset}, expected one of {list(CHARSETS)} or a 16 character string")
+    return charset
+
+
+T, L, B, R = 1, 2, 4, 8
 
 
 class Display:
-    def __init__(self, compaction: Compaction, with_labels=False):
-        self.G = compaction.G
+    def __init__(self, compaction: Compaction, with_labels=False, charset='heavy'):
+        self.graph = compaction.G
+        self.label = compaction.label
         self.pos = compaction.pos
         self.dcel = compaction.dcel
         self.rect_edges = compaction.rect_edges
@@ -91,28 +39,35 @@ class Display:
         self.v_h = compaction.v_h
         self.ori_edges = compaction.ori_edges
         self.bend_offsets = compaction.bend_offsets
+        self.charset = get_charset(charset)
+        self.table = str.maketrans(dict(enumerate(self.charset)))
 
-        self.minx = min(c[0] for v, c in self.pos.items() if not v_is_rect_dummy(v)) - self.v_w
-        self.maxx = max(c[0] for v, c in self.pos.items() if not v_is_rect_dummy(v)) + self.v_w
-        self.miny = min(c[1] for v, c in self.pos.items() if not v_is_rect_dummy(v)) - self.v_h
-        self.maxy = max(c[1] for v, c in self.pos.items() if not v_is_rect_dummy(v)) + self.v_h
+        drawn = compaction.pos_array[[not v_is_rect_dummy(v) for v in compaction.pos_nodes]]
+        self.minx, self.miny = (drawn.min(axis=0) - (self.v_w, self.v_h)).tolist()
+        self.maxx, self.maxy = (drawn.max(axis=0) + (self.v_w, self.v_h)).tolist()
 
-        self.output = {r: {c: BoxChar(0) for c in range(self.minx, self.maxx + 1)} for r in
-                       range(self.miny, self.maxy + 1)}
+        # direction masks of the cell at (x, y) live at canvas[y - miny, x - minx], labels are drawn over them
+        self.canvas = np.zeros((self.maxy - self.miny + 1, self.maxx - self.minx + 1), dtype=np.uint8)
+        self.labels = {}
 
         self.draw_edges()
         self.draw_vertices(with_labels)
 
+    @cached_property
+    def G(self):
+        """the final planarized graph, dummies included, handed back as networkx"""
+        return self.graph.to_networkx()
+
     def draw_vertices(self, with_labels=False):
         for vertex, (x, y) in self.pos.items():
             if not v_is_vertex(vertex):
                 continue
             self.draw_box(x, y, self.v_w, self.v_h)
             if with_labels:
-                label_len = len(str(vertex[1]))
-                mid_ind = label_len // 2
-                for c in range(label_len):
-                    self.output[y][x + c - mid_ind] = str(vertex[1])[c]
+                label = self.label(vertex)
+                mid_ind = len(label) // 2
+                for c in range(len(label)):
+                    self.labels[x + c - mid_ind, y] = label[c]
 
     def draw_edges(self):
         for edge in self.ori_edges:
@@ -156,28 +111,48 @@ class Display:
         y0, y1 = sorted([y0, y1])
         self.assert_inbounds(x0, y0)
         self.assert_inbounds(x1, y1)
+        r0, r1, c0, c1 = y0 - self.miny, y1 - self.miny, x0 - self.minx, x1 - self.minx
         if x0 == x1:
-            self.output[y0][x0] += BoxChar.b()
-            self.output[y1][x0] += BoxChar.t()
-            for i in range(y0 + 1, y1):
-                self.output[i][x0] += BoxChar.tb()
+            self.canvas[r0, c0] |= B
+            self.canvas[r1, c0] |= T
+            self.canvas[r0 + 1:r1, c0] |= T | B
         elif y0 == y1:
-            self.output[y0][x0] += BoxChar.r()
-            self.output[y0][x1] += BoxChar.l()
-            for i in range(x0 + 1, x1):
-                self.output[y0][i] += BoxChar.lr()
+            self.canvas[r0, c0] |= R
+            self.canvas[r0, c1] |= L
+            self.canvas[r0, c0 + 1:c1] |= L | R
         else:
             raise Exception("Input coordinates are not lines")
 
+    def rows(self):
+        """yields the rendered rows, without line breaks"""
+        labels = collections.defaultdict(dict)
+        for (x, y), char in self.labels.items():
+            if self.minx <= x <= self.maxx and self.miny <= y <= self.maxy:
+                labels[y - self.miny][x - self.minx] = char
+
+        for r, masks in enumerate(self.canvas):
+            row = masks.tobytes().decode('ascii').translate(self.table)
+            if r in labels:
+                row = list(row)
+                for c, char in labels[r].items():
+                    row[c] = char
+                row = "".join(row)
+            yield row
+
+    def encoded_rows(self, encoding='utf-8', errors='strict'):
+        """yields the rendered rows as bytes, each ending with a line break, errors as in str.encode"""
+        if encoding == 'ascii' and self.charset.isascii() and not self.labels:
+            table = bytes(self.charset, 'ascii') + bytes(range(16, 256))
+            for masks in self.canvas:
+                yield masks.tobytes().translate(table) + b"\n"
+        else:
+            for row in self.rows():
+                yield (row + "\n").encode(encoding, errors)
+
     def build_output(self):
-        out = []
-        for r in range(self.miny, self.maxy + 1):
-            line = []
-            for c in range(self.minx, self.maxx + 1):
-                line.append(self.output[r][c].char() if type(self.output[r][c]) is BoxChar else self.output[r][c])
-            out.append(line)
+        out = list(self.rows())
         out.append("")
-        return "\n".join("".join(line) for line in out)
+        return "\n".join(out)
 
     def write_to_file(self, path="./output.txt"):
         with open(path, "w") as f:
@@ -0,0 +1,226 @@
+import random
+
+rng = random.Random(0)
+
+
+class TurnNode:
+    __slots__ = ('he', 'turn', 'ok', 'prio', 'left', 'right', 'parent', 'size', 'sum', 'lo', 'hi', 'neg')
+
+    def __init__(self, he, turn, ok):
+        self.he = he
+        self.turn = turn
+        self.ok = ok
+        self.prio = rng.random()
+        self.left = self.right = self.parent = None
+        self.size = 1
+        self.sum = self.lo = self.hi = turn
+        self.neg = turn < 0
+
+
+def pull(node):
+    """recompute the aggregates of node from its children: size, turn sum, min and max prefix sum, reflex count"""
+    left, right = node.left, node.right
+    mid = node.turn
+    size, lo, hi, neg = 1, mid, mid, node.turn < 0
+    if left is not None:
+        left.parent = node
+        mid += left.sum
+        size += left.size
+        lo, hi = min(left.lo, mid), max(left.hi, mid)
+        neg += left.neg
+    if right is not None:
+        right.parent = node
+        size += right.size
+        lo, hi = min(lo, mid + right.lo), max(hi, mid + right.hi)
+        neg += right.neg
+        node.sum = mid + right.sum
+    else:
+        node.sum = mid
+    node.size, node.lo, node.hi, node.neg = size, lo, hi, neg
+
+
+def merge(a, b):
+    if a is None or b is None:
+        root = a if b is None else b
+    elif a.prio > b.prio:
+        a.right = merge(a.right, b)
+        pull(a)
+        root = a
+    else:
+        b.left = merge(a, b.left)
+        pull(b)
+        root = b
+    if root is not None:
+        root.parent = None
+    return root
+
+
+def split(node, k):
+    """the first k positions of node, and the rest"""
+    if node is None:
+        return None, None
+    left_size = node.left.size if node.left is not None else 0
+    if k <= left_size:
+        a, node.left = split(node.left, k)
+        pull(node)
+        node.parent = None
+        return a, node
+    node.right, b = split(node.right, k - left_size - 1)
+    pull(node)
+    node.parent = None
+    return node, b
+
+
+class FaceTurns:
+    """
+    The half-edges around a face, each with its turn to its succ and whether that succ can be a front edge, kept in
+    an implicit treap over their positions. Every node carries the turn sum, the min and max prefix turn count and the
+    number of reflex turns of its subtree, so finding the first reflex turn or the front edge of one, subdividing an
+    edge and cutting the face in two are all logarithmic in its size. nodes maps half-edges to their treap node, and is
+    shared by all faces so a half-edge is found in whichever face it is on.
+    """
+
+    def __init__(self, nodes, root=None):
+        self.nodes = nodes
+        self.root = root
+
+    @classmethod
+    def build(cls, nodes, items):
+        """from (he, turn, ok) in face order, as a cartesian tree in linear time"""
+        stack = []
+        for he, turn, ok in items:
+            node = nodes[he] = TurnNode(he, turn, ok)
+            last = None
+            while stack and stack[-1].prio < node.prio:
+                last = stack.pop()
+            node.left = last
+            if stack:
+                stack[-1].right = node
+            stack.append(node)
+        if not stack:
+            return cls(nodes)
+        order = [stack[0]]
+        for node in order:
+            order.extend(child for child in (node.left, node.right) if child is not None)
+        for node in reversed(order):
+            pull(node)
+        return cls(nodes, stack[0])
+
+    def __len__(self):
+        return self.root.size if self.root is not None else 0
+
+    def position(self, he):
+        node = self.nodes[he]
+        pos = node.left.size if node.left is not None else 0
+        while node.parent is not None:
+            if node is node.parent.right:
+                pos += node.parent.left.size + 1 if node.parent.left is not None else 1
+            node = node.parent
+        return pos
+
+    def locate(self, pos):
+        """node at pos, and the prefix turn count up to and including it"""
+        node, before = self.root, 0
+        while True:
+            left_size = node.left.size if node.left is not None else 0
+            if pos < left_size:
+                node = node.left
+                continue
+            before += node.left.sum if node.left is not None else 0
+            if pos == left_size:
+                return node, before + node.turn
+            before += node.turn
+            pos -= left_size + 1
+            node = node.right
+
+    def he_at(self, pos):
+        return self.locate(pos)[0].he
+
+    def first_reflex(self):
+        """position of the first negative turn, or None"""
+        node, pos = self.root, 0
+        if node is None or node.neg == 0:
+            return None
+        while True:
+            if node.left is not None and node.left.neg:
+                node = node.left
+                continue
+            pos += node.left.size if node.left is not None else 0
+            if node.turn < 0:
+                return pos
+            pos += 1
+            node = node.right
+
+    def first_reach(self, start, target, up):
+        """first position from start on whose prefix turn count is at least (up) or at most target, or None"""
+        def search(node, start, before):
+            if node is None or start >= node.size:
+                return None
+            if start <= 0 and (before + node.hi < target if up else before + node.lo > target):
+                return None
+            left_size = node.left.size if node.left is not None else 0
+            if start < left_size:
+                found = search(node.left, start, before)
+                if found is not None:
+                    return found
+            mid = before + (node.left.sum if node.left is not None else 0) + node.turn
+            if start <= left_size and (mid >= target if up else mid <= target):
+                return left_size
+            found = search(node.right, start - left_size - 1, mid)
+            return None if found is None else left_size + 1 + found
+
+        return search(self.root, start, 0)
+
+    def first_hit(self, start, end, target):
+        """first position in [start, end) whose prefix turn count is target and whose succ can be a front edge"""
+        while start < end:
+            before = self.locate(start - 1)[1] if start > 0 else 0
+            # turns go up one at a time, so the count can't step over target on the way up
+            pos = self.first_reach(start, target, before < target)
+            if pos is None or pos >= end:
+                return None
+            node, count = self.locate(pos)
+            if count == target and node.ok:
+                return pos
+            start = pos + 1
+        return None
+
+    def front(self, start, target):
+        """position of the succ of the first half-edge from start on whose prefix turn count reaches target"""
+        n = len(self)
+        before = self.locate(start - 1)[1] if start > 0 else 0
+        pos = self.first_hit(start, n, before + target)
+        if pos is None:
+            pos = self.first_hit(0, start, target - (self.root.sum - before))
+        if pos is None:
+            raise Exception(f"can't find front edge of {self.he_at(start)}")
+        return (pos + 1) % n
+
+    def subdivide(self, he, he_a, he_b):
+        """he was subdivided into he_a and he_b, which go straight, he_b keeps the turn of he"""
+        pos = self.position(he)
+        node = self.nodes.pop(he)
+        a, rest = split(self.root, pos)
+        _, b = split(rest, 1)
+        node_a, node_b = TurnNode(he_a, 0, True), TurnNode(he_b, node.turn, node.ok)
+        self.nodes[he_a], self.nodes[he_b] = node_a, node_b
+        self.root = merge(merge(a, node_a), merge(node_b, b))
+
+    def cut(self, j, k):
+        """the faces of positions j + 1 .. k and of k + 1 .. j, both wrapping around, this one is used up"""
+        lo, hi = min(j, k), max(j, k)
+        a, rest = split(self.root, lo + 1)
+        mid, b = split(rest, hi - lo)
+        self.root = None
+        inner, outer = FaceTurns(self.nodes, mid), FaceTurns(self.nodes, merge(b, a))
+        return (inner, outer) if j < k else (outer, inner)
+
+    def set_last(self, turn, ok):
+        rest, node = split(self.root, len(self) - 1)
+        node.turn, node.ok = turn, ok
+        pull(node)
+        self.root = merge(rest, node)
+
+    def push_front(self, he, turn, ok):
+        node = self.nodes[he] = TurnNode(he, turn, ok)
+        self.root = merge(node, self.root)
@@ -0,0 +1,383 @@
+import math
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+
+class InfeasibleFlow(Exception):
+    """no flow of the model meets its demands, capacities and bundles"""
+
+
+class FlowModel:
+    """
+    A flow network as flat arrays, shared by every backend: nodes and arcs (u, v, key) name what the node indices in
+    tail and head, and the arrays cost, capacity and demand (inflow - outflow == demand) number. Bundles are pairs of
+    arc indices whose flows sum to at most 1.
+    """
+
+    def __init__(self, nodes, arcs, tail, head, cost, capacity, demand, bundles=()):
+        self.nodes = nodes
+        self.arcs = arcs
+        self.tail = np.asarray(tail, dtype=np.int64)
+        self.head = np.asarray(head, dtype=np.int64)
+        self.cost = np.asarray(cost, dtype=float)
+        self.capacity = np.asarray(capacity, dtype=float)
+        self.demand = np.asarray(demand, dtype=float)
+        self.bundles = np.asarray(bundles, dtype=np.int64).reshape(-1, 2)
+
+    def incidence(self):
+        """Node-arc incidence matrix, +1 at the head and -1 at the tail of each arc (self loops cancel out)"""
+        A = np.zeros((len(self.nodes), len(self.arcs)))
+        cols = np.arange(len(self.arcs))
+        np.add.at(A, (self.head, cols), 1)
+        np.add.at(A, (self.tail, cols), -1)
+        return A
+
+    def fix(self, fixed):
+        """
+        The model left once the arcs in fixed (arc index: flow) carry that flow, and the indices of the arcs it keeps.
+        Their flow moves into the demands, and a fixed bundle member with flow closes the other one. Nodes left without
+        arcs are dropped, InfeasibleFlow if one of them still has demand.
+        """
+        is_fixed = np.zeros(len(self.arcs), dtype=bool)
+        fixed_flow = np.zeros(len(self.arcs))
+        for i, f in fixed.items():
+            is_fixed[i], fixed_flow[i] = True, f
+        free = np.flatnonzero(~is_fixed)
+
+        demand = self.demand.copy()
+        np.add.at(demand, self.tail, fixed_flow)
+        np.subtract.at(demand, self.head, fixed_flow)
+        used = np.zeros(len(self.nodes), dtype=bool)
+        used[self.tail[free]] = used[self.head[free]] = True
+        if demand[~used].any():
+            raise InfeasibleFlow("Orthogonalization flow network is infeasible")
+        node_ind = np.cumsum(used) - 1
+        arc_ind = np.full(len(self.arcs), -1)
+        arc_ind[free] = np.arange(len(free))
+
+        capacity = self.capacity[free]
+        for a, b in self.bundles.tolist():
+            if is_fixed[a] != is_fixed[b] and fixed_flow[a] + fixed_flow[b] > 0:
+                capacity[arc_ind[b if is_fixed[a] else a]] = 0
+        both = ~is_fixed[self.bundles].any(axis=1)
+        model = FlowModel([node for node, keep in zip(self.nodes, used.tolist()) if keep],
+                          [self.arcs[i] for i in free.tolist()], node_ind[self.tail[free]], node_ind[self.head[free]],
+                          self.cost[free], capacity, demand[used], arc_ind[self.bundles[both]])
+        return model, free
+
+
+class FlowSolver(ABC):
+    """
+    Solves the integer min cost flow of a FlowModel subject to its bundle constraints, and returns the flow on every
+    arc as an integer vector indexed like model.arcs.
+    """
+
+    @abstractmethod
+    def solve(self, model: FlowModel):
+        pass
+
+
+class NetworkSimplex:
+    """
+    Primal network simplex on the network of a FlowModel, bundles left out, with a big M artificial arc between every
+    node and an extra root to start from. The spanning tree is kept between calls to optimize, so after close or
+    reopen changes the cost of a few arcs, only the pivots those changes need are made. A closed arc costs big M,
+    like the artificials, which is more than any flow without them costs.
+    """
+
+    candidates = 1024  # arcs pivoted on per round of pricing
+
+    def __init__(self, model: FlowModel, flow=None):
+        """
+        flow, if given, is the flow to start from instead of none at all, the optimum of a similar model say. The
+        artificials then only carry the supply it leaves unmet, and its arcs take their place in the tree (see span).
+        """
+        n_nodes, n_arcs = len(model.nodes), len(model.arcs)
+        root = n_nodes
+        finite = model.capacity < 2 ** 32
+        capacity = np.where(finite, model.capacity, np.inf)
+        x = np.zeros(n_arcs) if flow is None else np.clip(np.asarray(flow, dtype=float), 0, capacity)
+        supply = (-model.demand).astype(np.int64)  # outflow - inflow
+        unmet = supply - np.bincount(model.tail, x, n_nodes).astype(np.int64) + np.bincount(model.head, x,
+                                                                                              n_nodes).astype(np.int64)
+        # on the flow of any basic arc
+        bound = int(np.maximum(unmet, 0).sum() + model.capacity[finite].sum() + x[~finite].sum()) + 1
+        self.big = int(np.abs(model.cost).sum()) * bound + 1
+        self.n_arcs = n_arcs
+
+        # real arcs, then node k's artificial arc at n_arcs + k, pointing the way its unmet supply has to go
+        out = unmet >= 0
+        self.tail = np.concatenate([model.tail, np.where(out, np.arange(n_nodes), root)])
+        self.head = np.concatenate([model.head, np.where(out, root, np.arange(n_nodes))])
+        self.real_cost = np.concatenate([model.cost.astype(np.int64), np.zeros(n_nodes, dtype=np.int64)])
+        self.cost = np.concatenate([model.cost.astype(np.int64), np.full(n_nodes, self.big, dtype=np.int64)])
+        self.capacity = np.concatenate([capacity, np.full(n_nodes, np.inf)])
+        self.x = np.concatenate([x, np.abs(unmet).astype(float)])
+
+        self.parent = [root] * n_nodes + [-1]
+        self.parent_arc = list(range(n_arcs, n_arcs + n_nodes)) + [-1]
+        self.depth = [1] * n_nodes + [0]
+        self.children = [set() for _ in range(n_nodes)] + [set(range(n_nodes))]
+        self.pi = np.zeros(n_nodes + 1, dtype=np.int64)
+        if flow is not None:
+            self.span()
+        self.update_potentials()
+
+    def span(self):
+        """
+        Hangs nodes from real arcs rather than from their artificials, searching from each node left on the root, arcs
+        with flow first. A child only hangs from an arc that can still send flow up to its parent, so the tree stays
+        strongly feasible. The artificials of the nodes moved keep their flow, off the tree.
+        """
+        n_nodes = len(self.parent) - 1
+        tail, head, x, capacity = (self.tail.tolist(), self.head.tolist(), self.x.tolist(), self.capacity.tolist())
+        incident = [[] for _ in range(n_nodes)]
+        for arc in sorted(range(self.n_arcs), key=lambda arc: x[arc] == 0):
+            incident[tail[arc]].append(arc)
+            incident[head[arc]].append(arc)
+
+        seen = [False] * n_nodes
+        for start in range(n_nodes):
+            if seen[start]:
+                continue
+            seen[start] = True
+            stack = [start]
+            while stack:
+                p = stack.pop()
+                for arc in incident[p]:
+                    c = head[arc] if tail[arc] == p else tail[arc]
+                    if seen[c] or not (x[arc] > 0 if tail[arc] == p else x[arc] < capacity[arc]):
+                        continue
+                    seen[c] = True
+                    self.children[-1].discard(c)
+                    self.parent[c], self.parent_arc[c] = p, arc
+                    self.depth[c] = self.depth[p] + 1
+                    self.children[p].add(c)
+                    stack.append(c)
+
+    def close(self, arc):
+        self.set_cost(arc, self.big)
+
+    def reopen(self, arc):
+        self.set_cost(arc, self.real_cost[arc])
+
+    def set_cost(self, arc, cost):
+        """only a tree arc moves potentials, those of the subtree below it"""
+        shift = cost - self.cost[arc]
+        self.cost[arc] = cost
+        for v, sign in ((self.tail[arc], -1), (self.head[arc], 1)):
+            if self.parent_arc[v] == arc:
+                self.pi[self.subtree(v)] += sign * shift
+
+    def subtree(self, v):
+        nodes = [v]
+        for u in nodes:
+            nodes.extend(self.children[u])
+        return nodes
+
+    def update_potentials(self):
+        """so that every tree arc has a reduced cost of 0, from the root down"""
+        pi, cost, tail = self.pi, self.cost, self.tail
+        stack = list(self.children[-1])
+        while stack:
+            v = stack.pop()
+            a = self.parent_arc[v]
+            pi[v] = pi[self.parent[v]] - cost[a] if tail[a] == v else pi[self.parent[v]] + cost[a]
+            stack.extend(self.children[v])
+
+    def feasible(self, closed):
+        """whether the flow avoids the artificials and the closed arcs"""
+        return not self.x[self.n_arcs:].any() and not self.x[list(closed)].any()
+
+    def flow(self):
+        return np.round(self.x[:self.n_arcs]).astype(np.int64)
+
+    def objective(self):
+        return int(self.real_cost @ self.x)
+
+    def optimize(self):
+        """
+        Pivots until no arc has a negative reduced cost. Pricing every arc is the costly part, so each round prices
+        them all once, and pivots on the best candidates for as long as they stay profitable.
+        """
+        x, capacity, cost, pi, tail, head = self.x, self.capacity, self.cost, self.pi, self.tail, self.head
+        while True:
+            rc = cost + pi[tail] - pi[head]
+            gain = np.maximum(np.where(x < capacity, -rc, 0), np.where(x > 0, rc, 0))
+            candidates = np.flatnonzero(gain > 0)
+            if len(candidates) == 0:
+                return
+            if len(candidates) > self.candidates:
+                best = np.argpartition(gain[candidates], -self.candidates)[-self.candidates:]
+                candidates = candidates[best[np.argsort(-gain[candidates[best]])]]
+            for e in candidates.tolist():
+                rc_e = cost[e] + pi[tail[e]] - pi[head[e]]
+                if rc_e < 0 and x[e] < capacity[e]:
+                    self.pivot(e, True)
+                elif rc_e > 0 and x[e] > 0:
+                    self.pivot(e, False)
+
+    def pivot(self, e, forward):
+        """sends as much flow as possible around the cycle e closes, from s to t along e"""
+        parent, parent_arc, depth, tail, x, capacity = (self.parent, self.parent_arc, self.depth, self.tail, self.x,
+                                                         self.capacity)
+        s, t = (int(tail[e]), int(self.head[e])) if forward else (int(self.head[e]), int(tail[e]))
+
+        # the paths from s and t up to their common ancestor, the apex of the cycle
+        s_path, t_path = [], []
+        u, v = s, t
+        while u != v:
+            if depth[u] >= depth[v]:
+                s_path.append(u)
+                u = parent[u]
+            else:
+                t_path.append(v)
+                v = parent[v]
+
+        # the cycle from the apex down to s, along e, and up from t back to the apex, as (arc, direction, node below)
+        cycle = [(parent_arc[w], tail[parent_arc[w]] != w, w) for w in reversed(s_path)]
+        cycle.append((e, forward, None))
+        cycle.extend((parent_arc[w], tail[parent_arc[w]] == w, w) for w in t_path)
+
+        # the last arc of least residual capacity leaves, which keeps the tree strongly feasible
+        delta, leave = math.inf, None
+        for arc, fwd, w in cycle:
+            residual = capacity[arc] - x[arc] if fwd else x[arc]
+            if residual <= delta:
+                delta, leave = residual, (arc, w)
+        for arc, fwd, _ in cycle:
+            x[arc] += delta if fwd else -delta
+
+        arc, w = leave
+        if arc == e:
+            return
+        # hang the subtree of w from the end of e inside it, reversing the tree path between them
+        q, r = (t, s) if w in t_path else (s, t)
+        self.children[parent[w]].discard(w)
+        v, p, a = q, r, e
+        while True:
+            old_p, old_a = parent[v], parent_arc[v]
+            parent[v], parent_arc[v] = p, a
+            self.children[p].add(v)
+            if v == w:
+                break
+            self.children[old_p].discard(v)
+            v, p, a = old_p, v, old_a
+
+        pi, cost = self.pi, self.cost
+        stack = [q]
+        while stack:
+            v = stack.pop()
+            depth[v] = depth[parent[v]] + 1
+            a = parent_arc[v]
+            pi[v] = pi[parent[v]] - cost[a] if tail[a] == v else pi[parent[v]] + cost[a]
+            stack.extend(self.children[v])
+
+
+class NetworkSimplexSolver(FlowSolver):
+    """
+    Default in-process backend: the network simplex above on the flow network alone, with depth first branch and
+    bound on the violated bundles, closing one of the two arcs in each branch. Memory stays linear in the size of the
+    model, and every branch re-optimizes from the spanning tree of the one before.
+    """
+
+    def solve(self, model: FlowModel):
+        ns = NetworkSimplex(model)
+        closed = set()
+
+        def solve_closed(arcs):
+            """the optimal flow with arcs closed, and its cost"""
+            for arc in closed - arcs:
+                ns.reopen(arc)
+            for arc in arcs - closed:
+                ns.close(arc)
+            closed.clear()
+            closed.update(arcs)
+            ns.optimize()
+            if not ns.feasible(closed):
+                return None, math.inf
+            return ns.flow(), ns.objective()
+
+        def violated(x):
+            return model.bundles[x[model.bundles[:, 0]] + x[model.bundles[:, 1]] > 1]
+
+        # dive for an incumbent first, closing one arc of every violated bundle at once
+        best_x, best_obj = None, math.inf
+        dive = frozenset()
+        x, obj = solve_closed(dive)
+        while x is not None:
+            bad = violated(x)
+            if len(bad) == 0:
+                best_x, best_obj = x, obj
+                break
+            dive |= set(bad[:, 0].tolist())
+            x, obj = solve_closed(dive)
+
+        stack = [frozenset()]
+        while stack:
+            arcs = stack.pop()
+            x, obj = solve_closed(arcs)
+            if obj >= best_obj:
+                continue
+            bad = violated(x)
+            if len(bad) == 0:
+                best_x, best_obj = x, obj
+                continue
+            a, b = bad[0].tolist()
+            stack.append(arcs | {b})
+            stack.append(arcs | {a})
+        if best_x is None:
+            raise InfeasibleFlow("Orthogonalization flow network is infeasible")
+        return best_x
+
+
+class CbcSolver(FlowSolver):
+    """
+    PuLP model solved by the external CBC binary. Requires PuLP to be installed.
+    """
+
+    def __init__(self, msg=False):
+        self.msg = msg
+
+    def solve(self, model: FlowModel):
+        import pulp
+
+        problem = pulp.LpProblem("KandinskyFlow", pulp.LpMinimize)
+        x = [pulp.LpVariable(f"x{i}", lowBound=0, upBound=cap, cat=pulp.LpInteger) for i, cap in
+             enumerate(model.capacity.tolist())]
+
+        terms = [[] for _ in model.nodes]
+        for i, (u, v) in enumerate(zip(model.tail.tolist(), model.head.tolist())):
+            if u != v:
+                terms[v].append((x[i], 1))
+                terms[u].append((x[i], -1))
+        for node_terms, demand in zip(terms, model.demand.tolist()):
+            # inflow - outflow = demand
+            problem += (pulp.LpAffineExpression(node_terms) == demand)
+
+        for a, b in model.bundles.tolist():
+            problem += (x[a] + x[b] <= 1)
+
+        problem += pulp.LpAffineExpression([(var, cost) for var, cost in zip(x, model.cost.tolist()) if cost != 0])
+
+        problem.solve(pulp.PULP_CBC_CMD(msg=self.msg))
+        if problem.status != 1:
+            raise InfeasibleFlow("Orthogonalization flow network is infeasible")
+
+        return np.fromiter((round(var.varValue) for var in x), dtype=np.int64, count=len(x))
+
+
+SOLVERS = {
+    'network': NetworkSimplexSolver,
+    'cbc': CbcSolver,
+}
+
+
+def get_solver(solver):
+    """Accepts a FlowSolver instance, or the name of one in SOLVERS"""
+    if isinstance(solver, FlowSolver):
+        return solver
+    if solver not in SOLVERS:
+        raise ValueError(f"Unknown flow solver {solver}, expected one of {list(SOLVERS)}")
+    return SOLVERS[solver]()
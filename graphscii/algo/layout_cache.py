@@ -0,0 +1,92 @@
+import collections
+import copy
+
+import networkx as nx
+from networkx.algorithms.isomorphism import GraphMatcher
+
+from .compaction import Compaction, vertex_size
+from .orthogonalize import Orthogonalize
+from .planarize import Planarize
+from .preprocess import Preprocess
+from .rectangularize import Rectangularize
+from .simplify import Simplify
+
+LayoutInfo = collections.namedtuple('LayoutInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class Template:
+    """a laid out component: its graph, its rectangularization and one compaction for every vertex width used"""
+
+    def __init__(self, component: nx.Graph, rectangularize: Rectangularize):
+        self.graph = nx.Graph(component)
+        self.rectangularize = rectangularize
+        self.compactions = {}
+
+    def compaction(self, vertex_labels, with_labels=False, executor=None):
+        """
+        Compaction of the template with the given user labels, (Kind.VERTEX, i) being labelled vertex_labels[i].
+        Only the vertex width depends on the labels, so positions are shared by every label set of the same width.
+        """
+        rectangularize = copy.copy(self.rectangularize)
+        rectangularize.vertex_labels = vertex_labels
+        size = vertex_size(rectangularize, with_labels)
+        if size not in self.compactions:
+            self.compactions[size] = Compaction(rectangularize, with_labels=with_labels, executor=executor)
+        compaction = copy.copy(self.compactions[size])
+        compaction.vertex_labels = vertex_labels
+        return compaction
+
+
+class LayoutCache:
+    """
+    Orthogonal layouts of the most recent maxsize distinct components, up to isomorphism. A component isomorphic to
+    one laid out before reuses its positions with its own vertices mapped in, skipping planarization through
+    compaction; only its labels (and the vertex width, if those are wider) can change the drawing. Candidates are
+    bucketed by weisfeiler lehman hash and confirmed with vf2.
+    """
+
+    def __init__(self, maxsize=64):
+        if maxsize is not None and maxsize < 0:
+            raise ValueError(f"maxsize must be non negative, got {maxsize}")
+        self.maxsize = maxsize
+        self.buckets = collections.OrderedDict()  # (wl hash, contract): [Template]
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def compaction(self, component: nx.Graph, with_labels=False, executor=None, contract=False):
+        key = (nx.weisfeiler_lehman_graph_hash(component), contract)
+        for template in self.buckets.get(key, ()):
+            matcher = GraphMatcher(template.graph, component)
+            if matcher.is_isomorphic():
+                self.hits += 1
+                self.buckets.move_to_end(key)
+                vertex_labels = [matcher.mapping[v] for v in template.graph.nodes()]
+                return template.compaction(vertex_labels, with_labels, executor)
+
+        self.misses += 1
+        processed = Preprocess(component)
+        simplified = Simplify(processed, contract)
+        planarized = Planarize(simplified)
+        orthogonalized = Orthogonalize(planarized)
+        rectangularized = Rectangularize(orthogonalized)
+        template = Template(component, rectangularized)
+        self.remember(key, template)
+        return template.compaction(rectangularized.vertex_labels, with_labels, executor)
+
+    def remember(self, key, template):
+        if self.maxsize == 0:
+            return
+        self.buckets.setdefault(key, []).append(template)
+        self.buckets.move_to_end(key)
+        self.size += 1
+        while self.maxsize is not None and self.size > self.maxsize:
+            _, evicted = self.buckets.popitem(last=False)
+            self.size -= len(evicted)
+
+    def clear(self):
+        self.buckets.clear()
+        self.size = self.hits = self.misses = 0
+
+    def info(self):
+        return LayoutInfo(self.hits, self.misses, self.maxsize, self.size)
@@ -1,165 +1,230 @@
 import collections
 
 import networkx as nx
-import pulp
+import numpy as np
 
+from .flow_solver import FlowModel, FlowSolver, InfeasibleFlow, NetworkSimplexSolver, get_solver
 from .planarize import Planarize
-from .utils import v_is_struct_dummy, v_is_face, v_is_structural, v_is_h_aux
+from .utils import DEBUG, Kind, v_is_struct_dummy, v_is_face, v_is_structural, v_is_h_aux
 
 
 class Orthogonalize:
-    def __init__(self, planarize: Planarize):
+    """
+    warm_start is the snapshot() of an earlier embedding of the same graph. Arcs it shares with this one keep their
+    flow, so angles and bends stay as they were, and only the ones at faces that are new and at the vertices around
+    them are solved for. When nothing fits around the kept flow, the whole network is solved.
+    """
+
+    def __init__(self, planarize: Planarize, solver: str | FlowSolver = 'network', warm_start=None):
         self.G = planarize.G
+        self.vertex_labels = planarize.vertex_labels
+        self.chains = planarize.chains
         self.dcel = planarize.dcel
-        self.network_flow = None
+        self.solver = get_solver(solver)
+        self.flow_model = None
+        self.flow = None
         self.angle_dict = None
         self.bend_dict = None
-
-        self.build_network_flow()
-        self.solve_network_flow()
-
-    def build_network_flow(self):
-        assert nx.is_planar(self.G)
-
-        self.network_flow = nx.MultiDiGraph()
+        self.zero_bends = None
+        # without any vertex that needs helpers, tamassia's plain network has no bundles and is a min cost flow
+        self.is_kandinsky = False
+        self.model_size = None
+
+        wants_helpers = [v for v in self.G.nodes() if not v_is_struct_dummy(v) and self.G.degree(v) >= 4]
+        if wants_helpers and all(self.G.degree(v) == 4 for v in wants_helpers):
+            # 0 degree angles at degree 4 vertices can save bends, but never below none, so a bend free tamassia
+            # shape (every grid gets one) is optimal as it is
+            self.build_flow_model()
+            self.solve_flow_model(warm_start)
+            if self.flow_model.cost @ self.flow == 0:
+                return
+        self.is_kandinsky = bool(wants_helpers)
+        self.build_flow_model()
+        self.solve_flow_model(warm_start)
+
+    def needs_helpers(self, v):
+        """
+        Only vertices of degree >= 4 can ever profit from 0 degree angles, so only they get kandinsky helper faces,
+        arcs and bundles, and only in a kandinsky network. Structural dummies never get them.
+        """
+        return self.is_kandinsky and not v_is_struct_dummy(v) and self.G.degree(v) >= 4
+
+    def build_flow_model(self):
+        """
+        Tamassia's network, with kandinsky's helpers where they are needed, as the arrays of a FlowModel. Angles flow
+        from vertices into faces and bends from face to face across an edge. Arcs are listed by tail, in the order
+        nodes were added.
+        """
+        if DEBUG:
+            assert nx.is_planar(self.G.to_networkx())
+
+        demand = {}
+        out = {}  # tail: {head: {key: (cost, capacity)}}
+
+        def add_arc(u, v, key, cost, capacity):
+            out.setdefault(u, {}).setdefault(v, {})[key] = (cost, capacity)
 
         for v in self.G.nodes():
-            self.network_flow.add_node(v, demand=self.G.degree[v] - 4)
-            if v_is_struct_dummy(v):
+            demand[v] = self.G.degree(v) - 4
+            if not self.needs_helpers(v):
                 continue
             surround_faces = list(self.dcel.vertices[v].surround_faces())
             for i, face in enumerate(surround_faces):
-                helper_face = (f"h_aux_face", (v, face.id, i))
-                self.network_flow.add_node(helper_face, demand=0)
+                demand[(Kind.H_AUX_FACE, (v, face.id, i))] = 0
 
         for face in self.dcel.faces.values():
             face_len = len(list(face.surround_half_edges()))
-            if face.is_external:
-                self.network_flow.add_node(face.id, demand=face_len + 4)
-            else:
-                self.network_flow.add_node(face.id, demand=face_len - 4)
+            demand[face.id] = face_len + 4 if face.is_external else face_len - 4
 
         for face in self.dcel.faces.values():
             for edge in face.surround_half_edges():
                 o_face = edge.twin.inc
-                self.network_flow.add_edge(edge.id[0], face.id, cost=0, capacity=3, key=edge.id)
-                self.network_flow.add_edge(face.id, o_face.id, cost=1, capacity=2 ** 32, key=edge.id)
+                add_arc(edge.id[0], face.id, edge.id, 0, 3)
+                add_arc(face.id, o_face.id, edge.id, 1, 2 ** 32)
 
+        bundles = []
         for v in self.G.nodes():
-            if v_is_struct_dummy(v):
+            if not self.needs_helpers(v):
                 continue
             surround_edges = list(self.dcel.vertices[v].surround_half_edges())
             surround_faces = [he.inc for he in surround_edges]  # identical index edge is one to the left
+            n = len(surround_faces)
+            helper_faces = [(Kind.H_AUX_FACE, (v, face.id, i)) for i, face in enumerate(surround_faces)]
             for i, face in enumerate(surround_faces):
-                prev_h_face = (
-                f"h_aux_face", (v, surround_faces[(i - 1) % len(surround_faces)].id, (i - 1) % len(surround_faces)))
                 prev_edge = surround_edges[i]
-                helper_face = (f"h_aux_face", (v, face.id, i))
-                next_h_face = (
-                f"h_aux_face", (v, surround_faces[(i + 1) % len(surround_faces)].id, (i + 1) % len(surround_faces)))
-                next_edge = surround_edges[(i + 1) % len(surround_edges)]
-                self.network_flow.add_edge(helper_face, v, cost=0, capacity=1, key=prev_edge.id)
-                self.network_flow.add_edge(face.id, prev_h_face, cost=1, capacity=1, key=prev_edge.id)
-                self.network_flow.add_edge(face.id, next_h_face, cost=1, capacity=1, key=next_edge.twin.id)
-
-    def solve_network_flow(self):
-        # flow_cost, self.flow_dict = nx.capacity_scaling(self.network_flow, "demand", "capacity", "cost")
-        lp_dict = {}
-        problem = pulp.LpProblem("KandinskyFlow", pulp.LpMinimize)
-        for u, v, key, data in self.network_flow.edges(keys=True, data=True):
-            var_name = f"flow_{u}_to_{v}_for_{key}"
-            if u not in lp_dict:
-                lp_dict[u] = {}
-            if v not in lp_dict[u]:
-                lp_dict[u][v] = {}
-            lp_dict[u][v][key] = pulp.LpVariable(name=var_name, lowBound=0, upBound=data['capacity'],
-                                                 cat=pulp.LpInteger)  # try integer?
-
-        for node, data in self.network_flow.nodes(data=True):
-            # inflow = outflow + deman
-            inflow = pulp.lpSum(lp_dict[u][v][key] for u, v, key in self.network_flow.in_edges(node, keys=True))
-            outflow = pulp.lpSum(lp_dict[u][v][key] for u, v, key in self.network_flow.out_edges(node, keys=True))
-            demand = data['demand']
-            problem += (inflow - outflow == demand)
-
-        # define bundles
-        for node in self.G.nodes():
-            if v_is_struct_dummy(node):
-                continue
-            # for each face1 to helper_v_face2
-            # and face2 to helper_v_face1
-            # the sum of these two flow values <= 1
-            surround_edges = list(self.dcel.vertices[node].surround_half_edges())
-            surround_faces = [he.inc for he in surround_edges]  # identical index edge is one to the left
-            for i in range(len(surround_faces)):
-                cur_face = surround_faces[i].id
-                helper_face = (f"h_aux_face", (node, cur_face, i))
-                next_face = surround_faces[(i + 1) % len(surround_faces)].id
-                n_helper_face = (f"h_aux_face", (node, next_face, (i + 1) % len(surround_faces)))
-                key = surround_edges[(i + 1) % len(surround_edges)].twin
-
-                problem += (lp_dict[cur_face][n_helper_face][key.id] + lp_dict[next_face][helper_face][
-                    key.twin.id] <= 1)
-
-        problem += pulp.lpSum(
-            lp_dict[u][v][key] * data['cost'] for u, v, key, data in self.network_flow.edges(keys=True, data=True))
-
-        solver = pulp.PULP_CBC_CMD(msg=False)
-        problem.solve(solver)
-        assert problem.status == 1
-
-        self.build_flow_dict(lp_dict)
-
-    def build_flow_dict(self, lp_dict):
+                next_edge = surround_edges[(i + 1) % n]
+                add_arc(helper_faces[i], v, prev_edge.id, 0, 1)
+                add_arc(face.id, helper_faces[(i - 1) % n], prev_edge.id, 1, 1)
+                add_arc(face.id, helper_faces[(i + 1) % n], next_edge.twin.id, 1, 1)
+                # face i to the helper of face i + 1 and face i + 1 to the helper of face i: at most one bend
+                bundles.append(((face.id, helper_faces[(i + 1) % n], next_edge.twin.id),
+                                (surround_faces[(i + 1) % n].id, helper_faces[i], next_edge.id)))
+
+        nodes = list(demand)
+        node_ind = {node: i for i, node in enumerate(nodes)}
+        arcs, tail, head, cost, capacity = [], [], [], [], []
+        for u in nodes:
+            for v, keys in out.get(u, {}).items():
+                for key, (c, cap) in keys.items():
+                    arcs.append((u, v, key))
+                    tail.append(node_ind[u])
+                    head.append(node_ind[v])
+                    cost.append(c)
+                    capacity.append(cap)
+        arc_ind = {arc: i for i, arc in enumerate(arcs)}
+        self.flow_model = FlowModel(nodes, arcs, tail, head, cost, capacity, list(demand.values()),
+                                    [(arc_ind[a], arc_ind[b]) for a, b in bundles])
+
+    def solve_flow_model(self, warm_start=None):
+        self.model_size = {
+            'nodes': len(self.flow_model.nodes),
+            'arcs': len(self.flow_model.arcs),
+            'bundles': len(self.flow_model.bundles),
+        }
+
+        flow = None
+        if warm_start:
+            try:
+                flow = self.solve_warm(warm_start)
+            except InfeasibleFlow:
+                pass  # the kept flow leaves no room for the edit, solve it all
+        if flow is None and not self.is_kandinsky:
+            # no bundle constraints, so this is a plain min cost flow
+            flow = NetworkSimplexSolver().solve(self.flow_model)
+        elif flow is None:
+            flow = self.solver.solve(self.flow_model)
+        self.flow = flow
+        self.build_flow_dict(flow)
+
+    def stable_keys(self):
+        """
+        Nodes of the network keyed by what they are rather than by the ids the dcel happened to give them: a face by
+        its half-edges, a helper by its vertex, face and the half-edge its corner starts at.
+        """
+        keys = {face.id: (Kind.FACE, (frozenset(he.id for he in face.surround_half_edges()), face.is_external))
+                for face in self.dcel.faces.values()}
+        for u, v, key in self.flow_model.arcs:
+            if v_is_h_aux(u) and v_is_structural(v):
+                keys[u] = (Kind.H_AUX_FACE, (v, keys[u[1][1]], key))
+        return keys
+
+    def snapshot(self):
+        """flow of every arc by stable keys, for the warm start of the next frame, before Rectangularize runs"""
+        keys = self.stable_keys()
+        return {(keys.get(u, u), keys.get(v, v), key): f for (u, v, key), f in zip(self.flow_model.arcs,
+                                                                                   self.flow.tolist())}
+
+    def solve_warm(self, warm_start):
+        """
+        Fixes the arcs warm_start knows, except around the vertices on a face it does not know (or that are new
+        themselves), whose angles have to make room for the edit, and solves for the rest.
+        """
+        keys = self.stable_keys()
+        arcs = [(keys.get(u, u), keys.get(v, v), key) for u, v, key in self.flow_model.arcs]
+        dirty = {u for (u, v, _), arc in zip(self.flow_model.arcs, arcs) if v_is_structural(u) and v_is_face(v) and
+                 arc not in warm_start}
+        dirty = {u for u, _, _ in self.flow_model.arcs if u in dirty or v_is_h_aux(u) and u[1][0] in dirty}
+        fixed = {}
+        for i, ((u, v, _), arc) in enumerate(zip(self.flow_model.arcs, arcs)):
+            if arc in warm_start and u not in dirty and v not in dirty:
+                fixed[i] = warm_start[arc]
+        if not fixed:
+            return None
+        model, free = self.flow_model.fix(fixed)
+        flow = np.zeros(len(self.flow_model.arcs), dtype=np.int64)
+        flow[list(fixed)] = list(fixed.values())
+        if len(free):
+            # without bundles this is a plain min cost flow, as below
+            flow[free] = (self.solver if self.is_kandinsky else NetworkSimplexSolver()).solve(model)
+        return flow
+
+    def build_flow_dict(self, flow):
+        """flow is the solution vector, indexed like self.flow_model.arcs"""
+        arcs = self.flow_model.arcs
+        flow = flow.tolist()
         # can first merge face -> vertex and vertex -> face
         # for face to face, must be careful
         # need to determine the order, and which bend to do, maybe return a bend dict instead
         self.bend_dict = {e: collections.deque() for e in self.dcel.half_edges}
-        for u in lp_dict:
-            for v in lp_dict[u]:
-                for key in lp_dict[u][v]:
-                    if v_is_face(u) and v_is_face(v):
-                        he = self.dcel.half_edges[key]
-                        if int(lp_dict[u][v][key].varValue) > 0:
-                            assert len(self.bend_dict[
-                                           he.twin.id]) == 0  # should not have left and right bends over middle of edge
-                            for i in range(int(lp_dict[u][v][key].varValue)):
-                                self.bend_dict[he.id].append('r')
-                                self.bend_dict[he.twin.id].append('l')
+        for (u, v, key), f in zip(arcs, flow):
+            if f > 0 and v_is_face(u) and v_is_face(v):
+                he = self.dcel.half_edges[key]
+                assert len(self.bend_dict[he.twin.id]) == 0  # should not have left and right bends over middle of edge
+                self.bend_dict[he.id].extend('r' * f)
+                self.bend_dict[he.twin.id].extend('l' * f)
 
         self.angle_dict = {}  # stores angle before the edge
-        for u in lp_dict:
-            for v in lp_dict[u]:
-                for key in lp_dict[u][v]:
-                    if v_is_structural(u) and v_is_face(v):
-                        if u not in self.angle_dict:
-                            self.angle_dict[u] = {}
-                        if v not in self.angle_dict[u]:
-                            self.angle_dict[u][v] = {}
-                        if key not in self.angle_dict[u][v]:
-                            self.angle_dict[u][v][key] = 0
-                        self.angle_dict[u][v][key] += int(lp_dict[u][v][key].varValue) + 1
-                    elif v_is_h_aux(u) and v_is_structural(v):
-                        ori_face = u[1][1]
-                        if v not in self.angle_dict:
-                            self.angle_dict[v] = {}
-                        if ori_face not in self.angle_dict[v]:
-                            self.angle_dict[v][ori_face] = {}
-                        if key not in self.angle_dict[v][ori_face]:
-                            self.angle_dict[v][ori_face][key] = 0
-                        self.angle_dict[v][ori_face][key] -= int(lp_dict[u][v][key].varValue)
-                    elif v_is_face(u) and v_is_h_aux(v):
-                        # these bends should go towards the side of the vertex defined by v
-                        # which direction should the bend go? all on right side of u
-                        vertex = v[1][0]
-                        he = self.dcel.half_edges[key]
-                        if int(lp_dict[u][v][key].varValue) == 1:  # cap is one for these
-                            ori, dest = he.get_points()
-                            if dest == vertex:
-                                # this is the next edge
-                                self.bend_dict[he.id].append('r')
-                                self.bend_dict[he.twin.id].appendleft('l')
-                            else:
-                                assert ori == vertex
-                                self.bend_dict[he.id].appendleft('r')
-                                self.bend_dict[he.twin.id].append('l')
+        claims = []  # (helper, half-edge out of its vertex whose first bend the helper put there)
+        for (u, v, key), f in zip(arcs, flow):
+            if v_is_structural(u) and v_is_face(v):
+                angles = self.angle_dict.setdefault(u, {}).setdefault(v, {})
+                angles[key] = angles.get(key, 0) + f + 1
+            elif v_is_h_aux(u) and v_is_structural(v):
+                ori_face = u[1][1]
+                angles = self.angle_dict.setdefault(v, {}).setdefault(ori_face, {})
+                angles[key] = angles.get(key, 0) - f
+            elif f == 1 and v_is_face(u) and v_is_h_aux(v):  # cap is one for these
+                # these bends should go towards the side of the vertex defined by v
+                # which direction should the bend go? all on right side of u
+                vertex = v[1][0]
+                he = self.dcel.half_edges[key]
+                ori, dest = he.get_points()
+                if dest == vertex:
+                    # this is the next edge
+                    self.bend_dict[he.id].append('r')
+                    self.bend_dict[he.twin.id].appendleft('l')
+                    claims.append((v, he.twin.id))
+                else:
+                    assert ori == vertex
+                    self.bend_dict[he.id].appendleft('r')
+                    self.bend_dict[he.twin.id].append('l')
+                    claims.append((v, he.id))
+
+        # half-edges out of a vertex whose first bend makes room for a 0 degree angle there, a helper may as well
+        # only take a 180 degree angle down to 90
+        corners = {u: (v, key) for u, v, key in arcs if v_is_h_aux(u) and v_is_structural(v)}
+        self.zero_bends = set()
+        for helper, he_id in claims:
+            vertex, key = corners[helper]
+            if self.angle_dict[vertex][helper[1][1]][key] == 0:
+                self.zero_bends.add(he_id)
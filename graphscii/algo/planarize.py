@@ -1,11 +1,8 @@
-import collections
-import itertools
-
 import networkx as nx
 
 from graphscii.dcel import Dcel
 from .simplify import Simplify
-from .utils import v_is_face
+from .utils import DEBUG, Kind
 
 
 class Planarize:
@@ -15,155 +12,174 @@ class Planarize:
 
     def __init__(self, simplify: Simplify):
         self.G = simplify.G
+        self.vertex_labels = simplify.vertex_labels
+        self.chains = simplify.chains
 
         self.d_cnt = 0
         self.ori_edges = [edge for edge in self.G.edges()]
-        self.edges_to_add = [edge for edge in self.G.edges()]
-        self.form_maximal_planar_subgraph()
+        self.edges_to_add = []
+
+        # a planar input pays for this single test, its embedding goes straight into the dcel
+        n, m = self.G.number_of_nodes(), self.G.number_of_edges()
+        is_planar, embedding = nx.check_planarity(self.G) if n < 3 or m <= 3 * n - 6 else (False, None)
+        if not is_planar:
+            embedding = self.form_maximal_planar_subgraph()
 
-        self.dcel = self.get_dcel_of_cur_graph()
-        self.planar_dual = self.get_planar_dual()
+        self.dcel = self.get_dcel_of_cur_graph(embedding)
+        # networkx is only needed for planarity testing, from here on the dcel keeps the graph
+        self.G = self.dcel.graph
 
         for edge in self.edges_to_add:
             self.add_edge_form_dummies(edge)
+        if DEBUG:
+            assert nx.is_planar(self.G.to_networkx())
+
+    @classmethod
+    def from_rotation(cls, rotation, ext, vertex_labels, d_cnt):
+        """
+        Planarize of a graph planarized before, given by the clockwise neighbors of every node (crossing dummies
+        included) and a half-edge (u, v) of the external face, skipping the planar subgraph and embedding.
+        Further edges can be added with add_edge_form_dummies.
+        """
+        planarize = cls.__new__(cls)
+        planarize.vertex_labels = vertex_labels
+        planarize.chains = {}
+        planarize.d_cnt = d_cnt
+        planarize.ori_edges = []
+        planarize.edges_to_add = []
+
+        G = nx.Graph()
+        G.add_nodes_from(rotation)
+        G.add_edges_from((u, v) for u, nbrs in rotation.items() for v in nbrs)
+        embedding = nx.PlanarEmbedding()
+        embedding.set_data(rotation)
+        planarize.dcel = Dcel(G, embedding)
+        planarize.dcel.ext_face = planarize.dcel.half_edges[ext].inc
+        planarize.dcel.ext_face.inc = planarize.dcel.half_edges[ext]  # the drawing is oriented from this half-edge
+        planarize.dcel.ext_face.is_external = True
+        planarize.G = planarize.dcel.graph
+        return planarize
+
+    def rotation(self):
+        """clockwise neighbors of every node and a half-edge of the external face, what from_rotation takes back"""
+        rotation = {v.id: [he.twin.ori.id for he in v.surround_half_edges()] for v in self.dcel.vertices.values()}
+        return rotation, self.dcel.ext_face.inc.id
 
     def add_edge_form_dummies(self, edge):
-        # first, find shortest path in planar dual consisting of only edge vertices, and faces
-        vis = set()
-        par = {}
-        path = []
-        q = collections.deque()
-        ok_vertices = [edge[0], edge[1]]
-
-        q.append((edge[0], None))
-        par[edge[0]] = None
-        vis.add(edge[0])
-
-        while len(q) > 0:
-            node, prev = q.popleft()
-            if node == edge[1]:
-                cur_node = node
-                while cur_node is not None:
-                    path.append(cur_node)
-                    cur_node = par[cur_node]
-                path = list(reversed(path))
-            for nxt in self.planar_dual.neighbors(node):
-                if nxt in vis or (not v_is_face(nxt) and nxt not in ok_vertices):
-                    continue
-                vis.add(nxt)
-                par[nxt] = node
-                q.append((nxt, node))
+        # first, find shortest path in planar dual from the faces around edge[0] to the faces around edge[1]
+        crossed = self.dcel.dual_path(edge[0], edge[1])
 
         def connect_nodes(prev_node, cur_node, succ_vu, succ_uv):
-            self.G.add_edge(prev_node, cur_node)
             self.dcel.connect_with_he(prev_node, cur_node, succ_uv, succ_vu)
 
-            he_p2m = self.dcel.half_edges[prev_node, cur_node]
-            for he in he_p2m.traverse():
-                self.planar_dual.add_edge(he.inc.id, he.twin.inc.id, key=he.id)
-                self.planar_dual.add_edge(he.twin.inc.id, he.inc.id, key=he.twin.id)
-            for he in he_p2m.twin.traverse():
-                self.planar_dual.add_edge(he.inc.id, he.twin.inc.id, key=he.id)
-                self.planar_dual.add_edge(he.twin.inc.id, he.inc.id, key=he.twin.id)
-            for node in he_p2m.inc.surround_vertices():
-                self.planar_dual.add_edge(node.id, he_p2m.inc.id, key=0)
-                self.planar_dual.add_edge(he_p2m.inc.id, node.id, key=0)
-            for node in he_p2m.twin.inc.surround_vertices():
-                self.planar_dual.add_edge(node.id, he_p2m.twin.inc.id, key=0)
-                self.planar_dual.add_edge(he_p2m.twin.inc.id, node.id, key=0)
-
-        for i, (u, v) in enumerate(list(itertools.pairwise(path))[1:-1]):
-            # even though there may be multiple edges from u to v (faces), we choose any one of them to form the edge
-            # crossing
-            bad_edge = None
-            for e in self.planar_dual[u][v]:
-                bad_edge = e
-                break
-
-            # bad_edge inc face is u
-            bad_he = self.dcel.half_edges[bad_edge]
-            assert bad_he.inc.id == u
-
-            prev_node = ('crossing_dummy', self.d_cnt - 1) if i > 0 else edge[0]
-            cur_node = ('crossing_dummy', self.d_cnt)
-            next_node = ('crossing_dummy', self.d_cnt + 1) if i < len(path) - 4 else edge[1]
-
-            self.G.remove_edge(bad_edge[0], bad_edge[1])
-            self.G.add_edge(bad_edge[0], cur_node)
-            self.G.add_edge(cur_node, bad_edge[1])
+        if len(crossed) == 0:
+            # edge[0] and edge[1] already share a face, no crossings required
+            face_ids = {face.id for face in self.dcel.vertices[edge[1]].surround_faces()}
+            face = next(f for f in self.dcel.vertices[edge[0]].surround_faces() if f.id in face_ids)
+            succ_vu = self.dcel.vertices[edge[0]].get_half_edge(face)
+            succ_uv = self.dcel.vertices[edge[1]].get_half_edge(face)
+            connect_nodes(edge[0], edge[1], succ_vu, succ_uv)
+            return
+
+        for i, bad_he in enumerate(crossed):
+            # bad_he inc face is the one we are leaving, its twin's is the one we are entering
+            bad_edge = bad_he.id
+            face, o_face = bad_he.inc, bad_he.twin.inc
+
+            prev_node = (Kind.CROSSING_DUMMY, self.d_cnt - 1) if i > 0 else edge[0]
+            cur_node = (Kind.CROSSING_DUMMY, self.d_cnt)
+            next_node = (Kind.CROSSING_DUMMY, self.d_cnt + 1) if i < len(crossed) - 1 else edge[1]
+
             self.dcel.add_node_between(bad_edge[0], cur_node, bad_edge[1])
 
-            succ_vu = self.dcel.vertices[prev_node].get_half_edge(bad_he.inc)
-            succ_uv = self.dcel.vertices[cur_node].get_half_edge(bad_he.inc)
+            succ_vu = self.dcel.vertices[prev_node].get_half_edge(face)
+            succ_uv = self.dcel.vertices[cur_node].get_half_edge(face)
             connect_nodes(prev_node, cur_node, succ_vu, succ_uv)
-            self.planar_dual.remove_node(u)  # nuke all relations to this face, reestablish after face split
 
             if next_node == edge[1]:
                 # need to add the last connection
-                succ_vu = self.dcel.vertices[cur_node].get_half_edge(bad_he.twin.inc)
-                succ_uv = self.dcel.vertices[next_node].get_half_edge(bad_he.twin.inc)
+                succ_vu = self.dcel.vertices[cur_node].get_half_edge(o_face)
+                succ_uv = self.dcel.vertices[next_node].get_half_edge(o_face)
                 connect_nodes(cur_node, next_node, succ_vu, succ_uv)
-                self.planar_dual.remove_node(v)
 
             self.d_cnt += 1
 
     def form_maximal_planar_subgraph(self):
         """
-        Gets MPS by first generating the DFS spanning tree, then trying to add each edge and checking planarity
+        Gets MPS by first generating the DFS spanning tree, then greedily adding the remaining edges in order.
+
+        Edges are inserted in batches whose size doubles after every planar batch, so long runs of addable edges cost
+        a single planarity test. A failing batch is bisected for its first edge that breaks planarity, the edges before
+        it go in, and the next batch starts from as many edges as went in before it rather than from 1. Since
+        planarity is monotone, that edge can never be added, and the result is the same MPS as the edge-by-edge
+        greedy. Every test only looks at the planar_core of the graph, which grows with its cycles rather than its
+        size. Returns the embedding of the MPS.
         """
-        added_edges = set()
         T = nx.dfs_tree(self.G)
         self.G.clear_edges()
         self.G.add_edges_from([edge for edge in T.edges()])
-        added_edges.update([edge for edge in T.edges()])
-        self.edges_to_add = [edge for edge in self.ori_edges if edge not in added_edges]
-
-        for edge in self.edges_to_add:
-            self.G.add_edge(edge[0], edge[1])
-            if not nx.is_planar(self.G):
-                self.G.remove_edge(edge[0], edge[1])
-            else:
-                added_edges.add(edge)
-        self.edges_to_add = [edge for edge in self.ori_edges if edge not in added_edges]
-
-    def get_dcel_of_cur_graph(self):
-        def get_external_face(of_dcel, of_pos):
-            """
-            Taken from tsmpy
-            """
-            if len(of_dcel.vertices) == 1:
-                for face in of_dcel.faces.values():
-                    return face
-            corner_node = min(of_pos, key=lambda k: (of_pos[k][0], of_pos[k][1]))
-
-            sine_vals = {}
-            for node in self.G.adj[corner_node]:
-                dx = of_pos[node][0] - of_pos[corner_node][0]
-                dy = of_pos[node][1] - of_pos[corner_node][1]
-                sine_vals[node] = dy / (dx ** 2 + dy ** 2) ** 0.5
-
-            other_node = min(sine_vals, key=lambda node: sine_vals[node])
-            return of_dcel.half_edges[corner_node, other_node].inc
-
-        is_planar, embedding = nx.check_planarity(self.G)
-        assert is_planar
-        pos = nx.combinatorial_embedding_to_pos(embedding)
+        # tree edges may be oriented differently from ori_edges, so test membership on the graph itself
+        self.edges_to_add = [edge for edge in self.ori_edges if not self.G.has_edge(*edge)]
+
+        def is_planar_with(edges):
+            adj = {v: set(nbrs) for v, nbrs in self.G.adj.items()}
+            for u, v in edges:
+                adj[u].add(v)
+                adj[v].add(u)
+            return nx.check_planarity(nx.Graph(planar_core(adj)))[0]
+
+        max_edges = 3 * self.G.number_of_nodes() - 6  # euler's bound, no planar graph has more edges than this
+        i, step = 0, 1
+        while i < len(self.edges_to_add) and self.G.number_of_edges() < max_edges:
+            batch = self.edges_to_add[i:i + min(step, max_edges - self.G.number_of_edges())]
+            if is_planar_with(batch):
+                self.G.add_edges_from(batch)
+                i += len(batch)
+                step *= 2
+                continue
+            # batch[:lo] is known to go in and batch[:hi] not to
+            lo, hi = 0, len(batch)
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if is_planar_with(batch[lo:mid]):
+                    self.G.add_edges_from(batch[lo:mid])
+                    lo = mid
+                else:
+                    hi = mid
+            i += hi  # batch[lo] can never be added
+            step = max(lo, 1)
+        self.edges_to_add = [edge for edge in self.ori_edges if not self.G.has_edge(*edge)]
+        _, embedding = nx.check_planarity(self.G)
+        return embedding
+
+    def get_dcel_of_cur_graph(self, embedding):
         dcel = Dcel(self.G, embedding)
-        dcel.ext_face = get_external_face(dcel, pos)
+        # the longest face goes outside, leaving the most room around the drawing; no coordinates are needed for it
+        dcel.ext_face = max(dcel.faces.values(), key=lambda face: len(list(face.surround_half_edges())))
         dcel.ext_face.is_external = True
         return dcel
 
-    def get_planar_dual(self):
-        cur_planar_dual = nx.MultiDiGraph()
-
-        for edge in self.G.edges():
-            he = self.dcel.half_edges[edge]
-            cur_planar_dual.add_edge(he.inc.id, he.twin.inc.id, key=he.id)  # connect the two faces
-            cur_planar_dual.add_edge(he.twin.inc.id, he.inc.id, key=he.twin.id)  # connect the two faces
 
-        for face in self.dcel.faces.values():
-            for vertex in face.surround_vertices():
-                cur_planar_dual.add_edge(face.id, vertex.id, key=0)  # only need one of these edges, ever
-                cur_planar_dual.add_edge(vertex.id, face.id, key=0)
-
-        return cur_planar_dual
+def planar_core(adj):
+    """
+    What is left of adj (node: set of neighbors, changed in place) after dropping nodes of degree 1 or less and
+    smoothing away those of degree 2, merging the parallel edges that leaves, for as long as there are any. Neither
+    changes planarity, and on a sparse graph most nodes go.
+    """
+    queue = [v for v, nbrs in adj.items() if len(nbrs) <= 2]
+    while queue:
+        v = queue.pop()
+        nbrs = adj.get(v)
+        if nbrs is None or len(nbrs) > 2:
+            continue
+        del adj[v]
+        for w in nbrs:
+            adj[w].discard(v)
+        if len(nbrs) == 2:
+            a, b = nbrs
+            if b not in adj[a]:
+                adj[a].add(b)
+                adj[b].add(a)
+                continue
+        queue.extend(w for w in nbrs if len(adj[w]) <= 2)
+    return adj
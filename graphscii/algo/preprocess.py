@@ -1,5 +1,7 @@
 import networkx as nx
 
+from .utils import Kind
+
 
 class Preprocess:
     """
@@ -11,5 +13,7 @@ class Preprocess:
             raise ValueError("Only undirected, simple graphs are currently supported")
 
         self.G = G.copy()
-        label_mapping = {v: ('vertex', v) for v in self.G.nodes()}
+        # vertices are numbered densely, so ids hash cheaply; the user's labels are only looked up when drawing
+        self.vertex_labels = list(self.G.nodes())
+        label_mapping = {v: (Kind.VERTEX, i) for i, v in enumerate(self.vertex_labels)}
         nx.relabel_nodes(self.G, label_mapping, copy=False)
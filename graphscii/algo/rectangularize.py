@@ -1,37 +1,41 @@
 import collections
 import itertools
-import sys
 
 import networkx as nx
 
 from graphscii.dcel import Dcel
+from .face_turns import FaceTurns
 from .orthogonalize import Orthogonalize
-from .utils import v_is_bend, v_is_vertex
+from .utils import Kind, v_is_bend, v_is_vertex
 
-# TODO: write without recursion
-sys.setrecursionlimit(100000)
+BORDER_NODES = tuple((Kind.RECT_DUMMY, -i) for i in range(1, 5))  # corners of the rectangle around the drawing
 
 
 class Rectangularize:
     def __init__(self, orthogonalize: Orthogonalize):
         self.G = orthogonalize.G
+        self.vertex_labels = orthogonalize.vertex_labels
+        self.chains = orthogonalize.chains
         self.dcel = orthogonalize.dcel
         self.angle_dict = orthogonalize.angle_dict
         self.bend_dict = orthogonalize.bend_dict
+        self.zero_bends = set()  # (vertex, bend): the first bend from vertex on an edge makes room for a 0 degree angle
         self.rb_cnt = 0
         self.rect_edges = set()
+        self.origin = {}  # bend or rect dummy: what it was made for, in the order they were made, see stable_keys
 
-        self.bend_point_processor()
+        self.bend_point_processor(orthogonalize.zero_bends)
         self.ori_ext_edge = self.dcel.ext_face.inc
         self.side_dict = self.face_side_processor()
+        self.expand_chains()
 
-        self.ori_edges = [edge for edge in self.G.edges]  # store edges before refine face
+        self.ori_edges = [edge for edge in self.G.edges()]  # store edges before refine face
         self.triangle_faces = set()
         self.triangle_edges = set()
         self.bend_offsets = {}
         self.refine_faces()
 
-    def bend_point_processor(self):
+    def bend_point_processor(self, zero_bends):
         b_cnt = 0
         ori_edges = list(self.G.edges())
         for edge in ori_edges:
@@ -43,23 +47,73 @@ class Rectangularize:
             u, v = he.get_points()
             lf_id, rf_id = he.twin.inc.id, he.inc.id
 
-            self.G.remove_edge(u, v)
-            self.angle_dict[u][rf_id][u, ('bend', b_cnt)] = self.angle_dict[u][rf_id].pop((u, v))
+            self.angle_dict[u][rf_id][u, (Kind.BEND, b_cnt)] = self.angle_dict[u][rf_id].pop((u, v))
 
             for i, bend in enumerate(bend_list):
-                curr_node = ('bend', b_cnt)
-                prev_node = ('bend', b_cnt - 1) if i > 0 else u
-                next_node = ('bend', b_cnt + 1) if i < len(bend_list) - 1 else v
-                self.G.add_edge(prev_node, curr_node)
+                curr_node = (Kind.BEND, b_cnt)
+                prev_node = (Kind.BEND, b_cnt - 1) if i > 0 else u
+                next_node = (Kind.BEND, b_cnt + 1) if i < len(bend_list) - 1 else v
                 self.dcel.add_node_between(prev_node, curr_node, v)
+                self.origin[curr_node] = ((u, i), (v, len(bend_list) - 1 - i))
                 self.angle_dict.setdefault(curr_node, {}).setdefault(
                     lf_id, {})[curr_node, prev_node] = 3 if bend == 'r' else 1  # twin edge
                 self.angle_dict.setdefault(curr_node, {}).setdefault(
                     rf_id, {})[curr_node, next_node] = 1 if bend == 'r' else 3
                 b_cnt += 1
 
-            self.angle_dict[v][lf_id][v, ('bend', b_cnt - 1)] = self.angle_dict[v][lf_id].pop((v, u))
-            self.G.add_edge(('bend', b_cnt - 1), v)
+            self.angle_dict[v][lf_id][v, (Kind.BEND, b_cnt - 1)] = self.angle_dict[v][lf_id].pop((v, u))
+            if (u, v) in zero_bends:
+                self.zero_bends.add((u, (Kind.BEND, b_cnt - len(bend_list))))
+            if (v, u) in zero_bends:
+                self.zero_bends.add((v, (Kind.BEND, b_cnt - 1)))
+
+    def expand_chains(self):
+        """
+        Puts the vertices contracted by Simplify back on their edges, spread in order over the straight pieces of the
+        routed edge, so compaction spaces them like any other vertex. Both ends of the edge have degree 3 or less, so
+        no piece shares a side of its vertex with other edges.
+        """
+        for (u, v), chain in self.chains.items():
+            pieces = self.route(u, v)
+            for i, he in enumerate(pieces):
+                prev, end = he.get_points()
+                side = self.side_dict[he]
+                for c in chain[i * len(chain) // len(pieces):(i + 1) * len(chain) // len(pieces)]:
+                    he_pe = self.dcel.half_edges[prev, end]
+                    self.side_dict.pop(he_pe)
+                    self.side_dict.pop(he_pe.twin)
+                    self.dcel.add_node_between(prev, c, end)
+                    for a, b in ((prev, c), (c, end)):
+                        self.side_dict[self.dcel.half_edges[a, b]] = side
+                        self.side_dict[self.dcel.half_edges[b, a]] = (side + 2) % 4
+                    prev = c
+
+    def route(self, u, v):
+        """half-edges of the edge u, v from u on, through its bends and straight through its crossings"""
+        for he in self.dcel.vertices[u].surround_half_edges():
+            pieces = [he]
+            while not v_is_vertex(he.twin.ori.id):
+                node, side = he.twin.ori, self.side_dict[he]
+                he = next(out for out in node.surround_half_edges()
+                          if out.twin is not he and (v_is_bend(node.id) or self.side_dict[out] == side))
+                pieces.append(he)
+            if he.twin.ori.id == v:
+                return pieces
+        raise Exception(f"No edge between {u} and {v}")
+
+    def stable_keys(self):
+        """
+        Bends and rect dummies keyed by where they were made rather than by the order they were made in: a bend by its
+        place on its edge counted from either end, a rect dummy by the node it extends and the side it goes to.
+        """
+        keys = {}
+        for node, origin in self.origin.items():
+            if v_is_bend(node):
+                keys[node] = Kind.BEND, frozenset(origin)
+            else:
+                extend, side = origin
+                keys[node] = Kind.RECT_DUMMY, (keys.get(extend, extend), side)
+        return keys
 
     def face_side_processor(self):
         side_dict = {}
@@ -77,29 +131,34 @@ class Rectangularize:
                     # 4 is single edge, 0 is shared side
                     side = (side + 2) % 4
 
-            for he in init_he.traverse():
+        # depth first over faces, each stack entry is the walk around a face whose sides are already set
+        set_side(self.dcel.ext_face.inc, 0)
+        stack = [self.dcel.ext_face.inc.traverse()]
+        while stack:
+            for he in stack[-1]:
                 if he.twin not in side_dict:
                     set_side(he.twin, (side_dict[he] + 2) % 4)
+                    stack.append(he.twin.traverse())
+                    break
+            else:
+                stack.pop()
 
-        set_side(self.dcel.ext_face.inc, 0)
         return side_dict
 
     def refine_faces(self):
-        def find_front(init_he, target):  # first
-            cnt = 0
-            for he in init_he.traverse():
-                side, next_side = self.side_dict[he], self.side_dict[he.succ]
-                if side == next_side:  # go straight
-                    pass
-                elif (side + 1) % 4 == next_side:  # go right
-                    cnt += 1
-                elif (side + 2) % 4 == next_side:  # turn around edge
-                    cnt -= 2
-                else:  # go left
-                    cnt -= 1
-                if cnt == target and he.succ not in self.triangle_edges:
-                    return he.succ
-            raise Exception(f"can't find front edge of {init_he}")
+        # face: FaceTurns of the faces refine_internal still has to look at, cut in two when it splits one of them
+        turn_index = {}
+        turn_nodes = {}
+
+        def turn(he):
+            # go straight, go right, turn around edge, go left
+            return (0, 1, -2, -1)[(self.side_dict[he.succ] - self.side_dict[he]) % 4]
+
+        def face_turns(face):
+            if face not in turn_index:
+                turn_index[face] = FaceTurns.build(turn_nodes, ((he, turn(he), he.succ not in self.triangle_edges)
+                                                                for he in face.surround_half_edges()))
+            return turn_index[face]
 
         def refine_zero(vertex):
             side_list = collections.deque(
@@ -122,23 +181,12 @@ class Rectangularize:
                 # must manually merge these two edges together
                 # add vertex to subdivide the edge closer to the middle,
                 # connect the bend from the outer edge to the new vertex
-                # middle is the first m, or first r if m does not exist
+                # middle is the one edge whose first bend (if any) was not put there by orthogonalize for a 0 degree
+                # angle at vertex, the others bend away from it into their angle. picking it by turn instead can use
+                # up a bend that the vertex at the other end of its edge needs for its own 0 degree angle
                 # start from the ones in the middle, then move outward
-                dir_list = [el[1] for el in sides[side]]
-                mid_ind = dir_list.index('m') if 'm' in dir_list else dir_list.index('r') if 'r' in dir_list else len(
-                    dir_list) - 1
-
-                # check if one before mid is left bend that goes to vertex, of which the next edge is also a 0 degree edge, then must switch
-                if mid_ind > 0 and sides[side][mid_ind - 1][1] == 'l' and sides[side][mid_ind][1] == 'r':
-                    cur_edge_in = sides[side][mid_ind - 1][0].succ
-                    next_edge_out = sides[side][mid_ind - 1][0].succ.succ
-                    if self.side_dict[cur_edge_in] == (self.side_dict[next_edge_out] + 2) % 4:
-                        # interesting case here... prefer subdivide left bend edge and merge right into left
-                        r_cur_edge_in = sides[side][mid_ind][0].succ
-                        r_next_edge_out = sides[side][mid_ind][0].succ.succ
-                        # assert self.side_dict[r_cur_edge_in] != (self.side_dict[r_next_edge_out] + 2) % 4
-                        # not sure if this assert is required, need access to german phd :(
-                        mid_ind = mid_ind - 1
+                claimed = [(vertex, he.twin.ori.id) in self.zero_bends for he, _ in sides[side]]
+                mid_ind = claimed.index(False) if claimed else 0
 
                 for i, (he, dir_label) in enumerate(sides[side]):
                     _, v = he.get_points()
@@ -169,17 +217,13 @@ class Rectangularize:
                         a_he = a[0]
                         a_u, a_v = a_he.get_points()
                         dummy_node = (
-                            'rect_dummy', self.rb_cnt)  # a_v is the bend, and we are extending it to this dummy node
+                            Kind.RECT_DUMMY, self.rb_cnt)  # a_v is the bend, and we are extending it to this dummy node
                         self.rb_cnt += 1
 
                         # print('subdividing', b_he, 'going to', b[1], 'attaching', a_v, 'on', a_he, 'to', dummy_node)
 
-                        # for the subdivision, update graph, dcel, and side_dict
+                        # for the subdivision, update dcel (and with it the graph), and side_dict
                         he_bu2bv = self.dcel.half_edges[b_u, b_v]
-                        self.G.add_node(dummy_node)
-                        self.G.remove_edge(b_u, b_v)
-                        self.G.add_edge(b_u, dummy_node)
-                        self.G.add_edge(dummy_node, b_v)
                         self.dcel.add_node_between(b_u, dummy_node, b_v)
 
                         he_bu2bm = self.dcel.half_edges[b_u, dummy_node]
@@ -193,9 +237,9 @@ class Rectangularize:
 
                         # add the edge, and connect
                         face = he_bu2bv.twin.inc if not flipped else he_bu2bv.inc  # right side twin's face is in the middle of these two
-                        self.G.add_edge(a_v, dummy_node)
                         self.rect_edges.add((a_v, dummy_node))
                         dummy_edge_side = self.side_dict[a_he.succ.twin]
+                        self.origin[dummy_node] = (a_v, dummy_edge_side)
 
                         # the way we call connect changes which one the external face is if face is the external face
                         # this is why we choose
@@ -223,54 +267,74 @@ class Rectangularize:
                 operate_pairwise(pt2)
 
         def refine_internal(face):
-            """Insert only one edge to make face more rect"""
+            """Insert only one edge to make face more rect, returns the two faces it was split into (or None)"""
             assert face not in self.triangle_faces
-            for he in face.surround_half_edges():
-                side, next_side = self.side_dict[he], self.side_dict[he.succ]
-                # if not go straight, right turn, or 0 degree
-                if side != next_side and (side + 1) % 4 != next_side:
-                    front_he = find_front(he, 1)
-                    extend_node_id = he.twin.ori.id
-
-                    l, r = front_he.ori.id, front_he.twin.ori.id
-                    he_l2r = self.dcel.half_edges[l, r]
-                    dummy_node_id = ("rect_dummy", self.rb_cnt)
-                    self.rb_cnt += 1
-                    self.G.remove_edge(l, r)
-                    self.G.add_edge(l, dummy_node_id)
-                    self.G.add_edge(dummy_node_id, r)
-
-                    face = self.dcel.half_edges[l, r].inc
-                    self.dcel.add_node_between(l, dummy_node_id, r)
-                    he_l2d = self.dcel.half_edges[l, dummy_node_id]
-                    he_d2r = self.dcel.half_edges[dummy_node_id, r]
-                    self.side_dict[he_l2d] = self.side_dict[he_l2r]
-                    self.side_dict[he_l2d.twin] = (self.side_dict[he_l2r] + 2) % 4
-                    self.side_dict[he_d2r] = self.side_dict[he_l2r]
-                    self.side_dict[he_d2r.twin] = (self.side_dict[he_l2r] + 2) % 4
-                    self.side_dict.pop(he_l2r)
-                    self.side_dict.pop(he_l2r.twin)
-
-                    self.G.add_edge(dummy_node_id, extend_node_id)
-                    self.rect_edges.add((dummy_node_id, extend_node_id))
-                    self.dcel.connect_with_face(face, extend_node_id, dummy_node_id, self.side_dict, self.side_dict[he])
-
-                    he_e2d = self.dcel.half_edges[extend_node_id, dummy_node_id]
-                    lf, rf = he_e2d.twin.inc, he_e2d.inc
-                    self.side_dict[he_e2d] = self.side_dict[he]
-                    self.side_dict[he_e2d.twin] = (self.side_dict[he] + 2) % 4
-
-                    refine_internal(lf)
-                    refine_internal(rf)
-                    break
+            index = face_turns(face)
+            # if not go straight, right turn, or 0 degree
+            j = index.first_reflex()
+            if j is None:
+                turn_index.pop(face)
+                return None
+
+            k = index.front(j, 1)
+            he, front_he = index.he_at(j), index.he_at(k)
+            extend_node_id = he.twin.ori.id
+
+            l, r = front_he.ori.id, front_he.twin.ori.id
+            he_l2r = self.dcel.half_edges[l, r]
+            o_face = he_l2r.twin.inc
+            dummy_node_id = (Kind.RECT_DUMMY, self.rb_cnt)
+            self.rb_cnt += 1
+            self.dcel.add_node_between(l, dummy_node_id, r)
+            he_l2d = self.dcel.half_edges[l, dummy_node_id]
+            he_d2r = self.dcel.half_edges[dummy_node_id, r]
+            self.side_dict[he_l2d] = self.side_dict[he_l2r]
+            self.side_dict[he_l2d.twin] = (self.side_dict[he_l2r] + 2) % 4
+            self.side_dict[he_d2r] = self.side_dict[he_l2r]
+            self.side_dict[he_d2r.twin] = (self.side_dict[he_l2r] + 2) % 4
+            self.side_dict.pop(he_l2r)
+            self.side_dict.pop(he_l2r.twin)
+
+            self.rect_edges.add((dummy_node_id, extend_node_id))
+            self.origin[dummy_node_id] = (extend_node_id, self.side_dict[he])
+            self.dcel.connect_with_face(face, extend_node_id, dummy_node_id, self.side_dict, self.side_dict[he],
+                                        reuse_face=True)
+
+            he_e2d = self.dcel.half_edges[extend_node_id, dummy_node_id]
+            he_d2e = he_e2d.twin
+            lf, rf = he_d2e.inc, he_e2d.inc
+            self.side_dict[he_e2d] = self.side_dict[he]
+            self.side_dict[he_d2e] = (self.side_dict[he] + 2) % 4
+
+            # subdivide front_he (and its twin) in the turn indices
+            index = turn_index.pop(face)
+            index.subdivide(he_l2r, he_l2d, he_d2r)
+            if o_face is face:
+                index.subdivide(he_l2r.twin, he_d2r.twin, he_l2d.twin)
+            elif o_face in turn_index:
+                turn_index[o_face].subdivide(he_l2r.twin, he_d2r.twin, he_l2d.twin)
+            ok = turn_nodes[he].ok
+
+            # rf runs he_e2d, he_d2r, ..., he and lf runs he_d2e, he.succ, ..., he_l2d
+            lf_index, rf_index = index.cut(index.position(he), index.position(he_l2d))
+            rf_index.set_last(turn(he), True)
+            rf_index.push_front(he_e2d, turn(he_e2d), True)
+            lf_index.set_last(turn(he_l2d), True)
+            lf_index.push_front(he_d2e, turn(he_d2e), ok)
+            turn_index[rf] = rf_index
+            turn_index[lf] = lf_index
+            return lf, rf
 
         def build_border(ori_ext_face):
             """Create border dcel"""
-            border_nodes = [("rect_dummy", -i) for i in range(1, 5)]
+            border_nodes = BORDER_NODES
             border_edges = [(border_nodes[i], border_nodes[(i + 1) % 4]) for i in range(4)]
             border_G = nx.Graph(border_edges)
             border_side_dict = {}
-            is_planar, border_embedding = nx.check_planarity(border_G)
+            # a cycle has a single embedding, no need to test for one
+            border_embedding = nx.PlanarEmbedding()
+            border_embedding.set_data({v: [border_nodes[i - 1], border_nodes[(i + 1) % 4]]
+                                       for i, v in enumerate(border_nodes)})
             border_dcel = Dcel(border_G, border_embedding)
             ext_face = border_dcel.half_edges[(border_nodes[0], border_nodes[1])].twin.inc
             border_dcel.ext_face = ext_face
@@ -288,11 +352,10 @@ class Rectangularize:
                 else:
                     # rename border_dcel.ext_face's name
                     border_dcel.faces.pop(face.id)
-                    face.id = ("face", -1)
+                    face.id = (Kind.FACE, -1)
                     border_dcel.faces[face.id] = face
+            # merge border dcel into self.dcel, its graph included
             self.G.add_edges_from(border_edges)
-
-            # merge border dcel into self.dcel
             self.dcel.vertices.update(border_dcel.vertices)
             self.dcel.half_edges.update(border_dcel.half_edges)
             self.dcel.faces.update(border_dcel.faces)
@@ -315,21 +378,17 @@ class Rectangularize:
                 # print(f'extend node {extend_node_id}, surround edges {[(edge, edge.inc) for edge in he.succ.ori.surround_half_edges()]}')
                 if len(self.G[extend_node_id]) <= 2:
                     front_he = border_side_dict[(side + 1) % 4]
-                    dummy_node_id = ("rect_dummy", self.rb_cnt)
+                    dummy_node_id = (Kind.RECT_DUMMY, self.rb_cnt)
                     self.rb_cnt += 1
                     l, r = front_he.ori.id, front_he.twin.ori.id
                     he_l2r = self.dcel.half_edges[l, r]
-                    # process G
-                    self.G.remove_edge(l, r)
-                    self.G.add_edge(l, dummy_node_id)
-                    self.G.add_edge(dummy_node_id, r)
-                    self.G.add_edge(dummy_node_id, extend_node_id)
                     self.rect_edges.add((dummy_node_id, extend_node_id))
+                    self.origin[dummy_node_id] = (extend_node_id, self.side_dict[he])
 
                     # # process dcel
 
                     self.dcel.add_node_between(l, dummy_node_id, r)
-                    self.dcel.connect_diff(ori_ext_face, extend_node_id, dummy_node_id)
+                    self.dcel.connect_diff(ori_ext_face, extend_node_id, dummy_node_id, he.succ)
 
                     he_e2d = self.dcel.half_edges[extend_node_id, dummy_node_id]
                     he_l2d = self.dcel.half_edges[l, dummy_node_id]
@@ -349,5 +408,12 @@ class Rectangularize:
             raise Exception("not connected")
 
         for face in list(self.dcel.faces.values()):
-            if face.id != ("face", -1) and face not in self.triangle_faces:
-                refine_internal(face)
+            if face.id != (Kind.FACE, -1) and face not in self.triangle_faces:
+                # refine lf completely before rf
+                worklist = [face]
+                while worklist:
+                    split = refine_internal(worklist.pop())
+                    if split is not None:
+                        lf, rf = split
+                        worklist.append(rf)
+                        worklist.append(lf)
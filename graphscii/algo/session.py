@@ -0,0 +1,367 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import networkx as nx
+
+from .compaction import Compaction
+from .display import Display
+from .orthogonalize import Orthogonalize
+from .planarize import Planarize
+from .preprocess import Preprocess
+from .rectangularize import BORDER_NODES, Rectangularize
+from .simplify import Simplify
+from .tree_layout import TreeLayout, is_tree
+from .tsm import handle_degenerate
+from .utils import Kind, v_is_bend, v_is_crossing_dummy, v_is_face, v_is_h_aux, v_is_rect_dummy, v_is_vertex
+
+
+def face_of(rotation, he):
+    """half-edges of the face left of he = (u, v), turning to the counterclockwise neighbor of u around v each time"""
+    face = [he]
+    u, v = he
+    while True:
+        nbrs = rotation[v]
+        u, v = v, nbrs[nbrs.index(u) - 1]
+        if (u, v) == he:
+            return face
+        face.append((u, v))
+
+
+def outer_angle(rotation, ext, v):
+    """neighbor w of v such that inserting before w in the rotation of v lands in the external face, or None"""
+    for u, w in face_of(rotation, ext):
+        if w == v:
+            return u
+    return None
+
+
+class ComponentLayout:
+    """
+    What a LayoutSession keeps of a drawn component: the planarization as clockwise neighbors of every node
+    (crossing dummies included), a half-edge of its external face, its last drawing and the orthogonalization and
+    compaction flows behind it. Vertex ids stay fixed for the life of the layout, removed vertices leave None in
+    vertex_labels.
+    """
+
+    def __init__(self, rotation, ext, vertex_labels, d_cnt):
+        self.rotation = rotation
+        self.ext = ext
+        self.vertex_labels = vertex_labels
+        self.d_cnt = d_cnt
+        self.ids = {label: (Kind.VERTEX, i) for i, label in enumerate(vertex_labels) if (Kind.VERTEX, i) in rotation}
+        self.pending = []  # edges to add through the dual on the next redraw
+        self.text = None
+        self.flow = {}  # Orthogonalize.snapshot() of the last drawing, the warm start of the next
+        self.compaction = {}  # Compaction.snapshot() of the last drawing, likewise
+
+    @classmethod
+    def single(cls, node):
+        return cls({(Kind.VERTEX, 0): []}, None, [node], 0)
+
+    def outer_angle(self, v):
+        """
+        Neighbor w of v such that inserting before w in the rotation of v puts the new edge in the external face,
+        v itself when v has no neighbors yet, None when v is not on the external face.
+        """
+        if not self.rotation[v]:
+            return v
+        return outer_angle(self.rotation, self.ext, v)
+
+    def path(self, u, v):
+        """the planarized nodes of the edge from vertex u to vertex v, straight through its crossings"""
+        for nxt in self.rotation[u]:
+            nodes, prev = [u], u
+            while v_is_crossing_dummy(nxt):
+                nodes.append(nxt)
+                nbrs = self.rotation[nxt]
+                prev, nxt = nxt, nbrs[(nbrs.index(prev) + 2) % 4]
+            if nxt == v:
+                return nodes + [v]
+        raise Exception(f"No edge between {u} and {v}")
+
+    def join(self, u, other, v):
+        """
+        The layout of both components joined by the edge u, v (u in self, v in other), one placed in a face of the
+        other next to the joined vertex. None if neither vertex is on its external face, as the edge would have to
+        cross one of them.
+        """
+        def shift(node):
+            offset = len(self.vertex_labels) if v_is_vertex(node) else self.d_cnt
+            return node[0], node[1] + offset
+
+        def shift_key(node):
+            """of a node in the flow of other, see Orthogonalize.stable_keys"""
+            if v_is_face(node):
+                hes, is_external = node[1]
+                return Kind.FACE, (frozenset((shift(a), shift(b)) for a, b in hes), is_external)
+            if v_is_h_aux(node):
+                v, face, (a, b) = node[1]
+                return Kind.H_AUX_FACE, (shift(v), shift_key(face), (shift(a), shift(b)))
+            return shift(node)
+
+        def shift_origin(node):
+            """of a node in the compaction of other, see Rectangularize.stable_keys"""
+            if v_is_bend(node):
+                return Kind.BEND, frozenset((shift(a), i) for a, i in node[1])
+            if v_is_rect_dummy(node):
+                extend, side = node[1]
+                return Kind.RECT_DUMMY, (shift_origin(extend), side)
+            return shift(node)
+
+        u_id, v_id = self.ids[u], shift(other.ids[v])
+        rotation = {node: list(nbrs) for node, nbrs in self.rotation.items()}
+        rotation.update({shift(node): [shift(n) for n in nbrs] for node, nbrs in other.rotation.items()})
+        u_angle, v_angle = self.outer_angle(u_id), other.outer_angle(other.ids[v])
+        if v_angle is not None:
+            # other goes into a face around u, the external one if u is on it
+            ext = self.ext if self.ext is not None else (tuple(map(shift, other.ext)) if other.ext is not None else (u_id, v_id))
+            v_angle = shift(v_angle)
+            if u_angle is None:
+                u_angle = rotation[u_id][0]
+        elif u_angle is not None:
+            ext = tuple(map(shift, other.ext))
+            v_angle = rotation[v_id][0]
+        else:
+            return None
+
+        for a, b, angle in ((u_id, v_id, u_angle), (v_id, u_id, v_angle)):
+            nbrs = rotation[a]
+            nbrs.insert(nbrs.index(angle) if angle != a else 0, b)
+        layout = ComponentLayout(rotation, ext, self.vertex_labels + other.vertex_labels, self.d_cnt + other.d_cnt)
+        layout.pending = self.pending + other.pending
+        layout.flow = dict(self.flow)
+        layout.flow.update(((shift_key(a), shift_key(b), (shift(key[0]), shift(key[1]))), f)
+                           for (a, b, key), f in other.flow.items())
+        # the border of other goes, its lengths would only clash with the ones of self
+        layout.compaction = dict(self.compaction)
+        layout.compaction.update(((shift_origin(a), shift_origin(b)), length) for (a, b), length in
+                                 other.compaction.items() if a not in BORDER_NODES and b not in BORDER_NODES)
+        return layout
+
+    def cut(self, edges, nodes=()):
+        """
+        The layouts left after removing edges and then nodes (user labels), crossings that lost an edge smoothed
+        away. Every part that fell apart gets its own layout, its external face taken from the faces that merged.
+        Single vertices get none. None if the rest can not be kept (e.g. a pending edge now joins two parts).
+        """
+        rotation = {node: list(nbrs) for node, nbrs in self.rotation.items()}
+        edges = {frozenset(edge) for edge in edges}
+        pending = [(u, v) for u, v in self.pending if frozenset((u, v)) not in edges]
+        in_rotation = edges.difference(frozenset(edge) for edge in self.pending)
+
+        removed, touched, dummies = [], [], []
+        for u, v in in_rotation:
+            path = self.path(self.ids[u], self.ids[v])
+            dummies.extend(path[1:-1])
+            removed.extend(zip(path, path[1:]))
+        seen = set()
+        for a, b in removed:
+            for he in ((a, b), (b, a)):
+                if he not in seen:
+                    face = face_of(rotation, he)
+                    seen.update(face)
+                    touched.extend(face)
+        for a, b in removed:
+            rotation[a].remove(b)
+            rotation[b].remove(a)
+
+        vertex_labels = list(self.vertex_labels)
+        for node in nodes:
+            rotation.pop(self.ids[node])
+            vertex_labels[self.ids[node][1]] = None
+
+        renamed = {}
+        for c in dummies:
+            if c not in rotation:
+                continue
+            if not rotation[c]:
+                rotation.pop(c)
+                continue
+            p, q = rotation.pop(c)
+            if q in rotation[p]:
+                return None  # the smoothed edge would double an existing one
+            rotation[p][rotation[p].index(c)] = q
+            rotation[q][rotation[q].index(c)] = p
+            renamed.update({(p, c): (p, q), (c, q): (p, q), (q, c): (q, p), (c, p): (q, p)})
+
+        def alive(he):
+            while he in renamed:
+                he = renamed[he]
+            return he if he[0] in rotation and he[1] in rotation[he[0]] else None
+
+        parts, part_of = [], {}
+        for start in rotation:
+            if start in part_of:
+                continue
+            part_of[start] = len(parts)
+            stack, part = [start], [start]
+            while stack:
+                for nxt in rotation[stack.pop()]:
+                    if nxt not in part_of:
+                        part_of[nxt] = len(parts)
+                        stack.append(nxt)
+                        part.append(nxt)
+            parts.append(part)
+
+        ext_candidates = [he for he in map(alive, [self.ext] + touched) if he is not None]
+        layouts = []
+        for i, part in enumerate(parts):
+            if len(part) == 1:
+                layouts.append(None)
+                continue
+            ext = next((he for he in ext_candidates if part_of[he[0]] == i), (part[0], rotation[part[0]][0]))
+            members = set(part)
+            labels = [label if (Kind.VERTEX, j) in members else None for j, label in enumerate(vertex_labels)]
+            layouts.append(ComponentLayout({node: rotation[node] for node in rotation if node in members}, ext, labels,
+                                           self.d_cnt))
+            layouts[-1].flow = self.flow
+            layouts[-1].compaction = self.compaction
+
+        ids = {label: (Kind.VERTEX, i) for i, label in enumerate(vertex_labels) if label is not None}
+        for u, v in pending:
+            if part_of[ids[u]] != part_of[ids[v]]:
+                return None
+            layouts[part_of[ids[u]]].pending.append((u, v))
+        return [layout for layout in layouts if layout is not None]
+
+
+class LayoutSession:
+    """
+    Draws a graph that changes a few nodes or edges at a time. Every component keeps its planarization between
+    frames, so an edit only redraws the components it touches, without a new planar subgraph or embedding: new edges
+    are routed through the faces of the previous embedding, removed ones are taken out of it. Untouched parts of the
+    embedding stay put, and so do their angles and bends, which keeps consecutive frames alike and only solves the
+    orthogonalization around the edits. Compaction starts from the edge lengths of the last frame. relayout() starts
+    over from scratch. Trees are drawn by TreeLayout every frame, as in to_ascii. workers > 1 (or None) solves
+    compaction on a process pool that lives as long as the session, close() (or a with block) shuts it down.
+    """
+
+    def __init__(self, graph: nx.Graph = None, with_labels=False, charset='heavy', workers=1):
+        if graph is not None and (graph.is_directed() or graph.is_multigraph()):
+            raise ValueError("Only undirected, simple graphs are currently supported")
+        self.graph = graph.copy() if graph is not None else nx.Graph()
+        self.with_labels = with_labels
+        self.charset = charset
+        self.workers = workers
+        self.executor = None  # started on the first draw that needs it
+        self.layouts = {}  # node: ComponentLayout of its component, for components drawn before
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def add_node(self, v):
+        self.graph.add_node(v)
+
+    def add_edge(self, u, v):
+        if u == v:
+            raise Exception("Graphs with loops are not supported yet.")
+        if self.graph.has_edge(u, v):
+            return
+        isolated = [self.graph.degree(w) == 0 if w in self.graph else True for w in (u, v)]
+        self.graph.add_edge(u, v)
+        a, b = self.layouts.get(u), self.layouts.get(v)
+        if a is not None and a is b:
+            a.pending.append((u, v))
+            a.text = None
+            return
+
+        a = a if a is not None or not isolated[0] else ComponentLayout.single(u)
+        b = b if b is not None or not isolated[1] else ComponentLayout.single(v)
+        joined = a.join(u, b, v) if a is not None and b is not None else None
+        self.replace(nx.node_connected_component(self.graph, u), [joined] if joined is not None else None)
+
+    def remove_edge(self, u, v):
+        self.graph.remove_edge(u, v)
+        layout = self.layouts.get(u)
+        if layout is not None:
+            self.cut(layout, [(u, v)])
+
+    def remove_node(self, v):
+        edges = [(v, u) for u in self.graph[v]]
+        self.graph.remove_node(v)
+        layout = self.layouts.get(v)
+        if layout is not None:
+            self.cut(layout, edges, [v])
+
+    def cut(self, layout, edges, nodes=()):
+        layouts = layout.cut(edges, nodes)
+        # edges of components that just fell apart may still cross each other, then they are laid out anew
+        if layouts is not None and any(set(part.ids) != nx.node_connected_component(self.graph, next(iter(part.ids)))
+                                       for part in layouts):
+            layouts = None
+        self.replace(layout.ids, layouts)
+
+    def replace(self, nodes, layouts):
+        """drop the layouts of nodes for new ones, or for a fresh layout on the next render if layouts is None"""
+        for node in list(nodes):
+            self.layouts.pop(node, None)
+        for layout in layouts or ():
+            for node in layout.ids:
+                self.layouts[node] = layout
+
+    def relayout(self):
+        self.layouts.clear()
+
+    def render(self):
+        out = []
+        for c in nx.connected_components(self.graph):
+            component = self.graph.subgraph(c)
+            if nx.number_of_nodes(component) == 1:
+                out.append(handle_degenerate(next(iter(component.nodes())), self.with_labels, self.charset))
+                continue
+            if is_tree(component):
+                # linear time, nothing worth keeping between frames
+                tree = TreeLayout(Preprocess(component), with_labels=self.with_labels)
+                out.append(Display(tree, with_labels=self.with_labels, charset=self.charset).build_output())
+                continue
+            layout = self.layouts.get(next(iter(component.nodes())))
+            if layout is None:
+                layout = self.lay_out(component)
+            elif layout.text is None:
+                self.redraw(layout)
+            out.append(layout.text)
+        return "".join(out)
+
+    def lay_out(self, component):
+        processed = Preprocess(component)
+        simplified = Simplify(processed)
+        planarized = Planarize(simplified)
+        layout = ComponentLayout(*planarized.rotation(), planarized.vertex_labels, planarized.d_cnt)
+        self.draw(planarized, layout)
+        for node in layout.ids:
+            self.layouts[node] = layout
+        return layout
+
+    def redraw(self, layout):
+        planarized = Planarize.from_rotation(layout.rotation, layout.ext, layout.vertex_labels, layout.d_cnt)
+        for u, v in layout.pending:
+            planarized.add_edge_form_dummies((layout.ids[u], layout.ids[v]))
+        ext = planarized.dcel.half_edges.get(layout.ext)
+        if ext is not None and ext.inc is planarized.dcel.ext_face:
+            planarized.dcel.ext_face.inc = ext  # keep the orientation of the last frame
+        layout.pending = []
+        layout.rotation, layout.ext = planarized.rotation()
+        layout.d_cnt = planarized.d_cnt
+        self.draw(planarized, layout)
+
+    def draw(self, planarized, layout):
+        """
+        The angles and bends of layout are kept where its faces are, only those around the edits are solved anew, and
+        compaction starts from its edge lengths.
+        """
+        orthogonalized = Orthogonalize(planarized, warm_start=layout.flow)
+        layout.flow = orthogonalized.snapshot()  # rectangularize changes the dcel
+        rectangularized = Rectangularize(orthogonalized)
+        if self.executor is None and (self.workers is None or self.workers > 1):
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        compacted = Compaction(rectangularized, with_labels=self.with_labels, executor=self.executor,
+                               warm_start=layout.compaction or None)
+        layout.compaction = compacted.snapshot()
+        layout.text = Display(compacted, with_labels=self.with_labels, charset=self.charset).build_output()
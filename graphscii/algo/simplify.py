@@ -4,12 +4,68 @@ from .preprocess import Preprocess
 class Simplify:
     """
     Given a graph, which may contain loops, return a simplified graph by inserting dummy nodes.
+    With contract, maximal chains of degree 2 vertices are also contracted into single edges, see contract_chains.
     """
 
-    def __init__(self, preprocess: Preprocess):
+    def __init__(self, preprocess: Preprocess, contract=False):
         self.G = preprocess.G
+        self.vertex_labels = preprocess.vertex_labels
         self.s_cnt = 0
+        self.chains = {}  # (u, v): vertices contracted into the edge u, v, in order from u to v
 
         for u, v in list(self.G.edges()):
             if u == v:
                 raise Exception("Graphs with loops are not supported yet.")
+
+        if contract:
+            self.contract_chains()
+
+    def contract_chains(self):
+        """
+        Replaces every maximal path of degree 2 vertices by a single edge between its ends, in linear time. They
+        never change the embedding, and are put back along the routed edge by Rectangularize, so the later stages only
+        see the rest of the graph. Where that edge would be a loop or double an existing one, the first vertex of the
+        chain (and the last, for a loop) stays in the graph. So does the vertex next to an end of degree 4 or more,
+        whose edges may share a side and leave no room along the edge for the chain.
+        """
+        G = self.G
+        chains = []
+        seen = set()
+
+        def walk(a, c):
+            """the chain entered from a through c, and the vertex it ends at"""
+            chain = []
+            while G.degree(c) == 2 and c not in seen:
+                seen.add(c)
+                chain.append(c)
+                a, c = c, next(n for n in G[c] if n != a)
+            return chain, c
+
+        for a in list(G.nodes()):
+            if G.degree(a) == 2:
+                continue
+            for c in list(G[a]):
+                chain, b = walk(a, c)
+                if chain:
+                    chains.append((a, chain, b))
+        for a in list(G.nodes()):
+            # whatever is left are cycles on their own, each is cut open at its first vertex
+            if G.degree(a) == 2 and a not in seen:
+                seen.add(a)
+                chain, b = walk(a, next(iter(G[a])))
+                chains.append((a, chain, b))
+
+        for a, chain, b in chains:
+            if a == b:
+                a, chain, b = chain[0], chain[1:-1], chain[-1]
+            if chain and G.degree(a) >= 4:
+                a, chain = chain[0], chain[1:]
+            if chain and G.degree(b) >= 4:
+                chain, b = chain[:-1], chain[-1]
+            if chain and G.has_edge(a, b):
+                a, chain = chain[0], chain[1:]
+            if not chain:
+                continue
+            G.remove_nodes_from(chain)
+            G.add_edge(a, b)
+            self.chains[a, b] = chain
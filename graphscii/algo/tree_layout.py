@@ -0,0 +1,180 @@
+from collections import deque
+
+import networkx as nx
+import numpy as np
+
+from .compaction import node_label
+from .preprocess import Preprocess
+from .utils import Kind
+from ..dcel import Graph
+
+
+def is_tree(component: nx.Graph):
+    """for a connected component, in constant time"""
+    return component.number_of_edges() == component.number_of_nodes() - 1
+
+
+class TreeLayout:
+    """
+    Layered orthogonal drawing of a tree in linear time, standing in for Planarize through Compaction in front of
+    Display. The tree hangs from its center (a path from one end), in rows of boxes as wide as the pipeline's. An
+    only child goes right of its parent on the same row, so chains stay flat. Other children go on the row below,
+    their parent centered over them and joined to them by one bus right under its box, which any degree fits in.
+    Subtrees are packed as tightly as their contours allow (Reingold-Tilford), contours kept deepest row first so
+    merging two costs only the shallower of them.
+    """
+
+    def __init__(self, preprocess: Preprocess, with_labels=False):
+        self.vertex_labels = preprocess.vertex_labels
+        tree = preprocess.G
+        if not is_tree(tree):
+            raise Exception("TreeLayout needs a tree")
+
+        if with_labels:
+            max_label_w = max(len(node_label(self.vertex_labels, v)) for v in tree.nodes())
+        else:
+            max_label_w = 0
+        # compaction.vertex_size counts the border corners of rectangularize as labels too ("-1"), so the pipeline
+        # never draws a labelled box narrower than ┃ 0 ┃
+        self.v_w = max(max_label_w // 2 + 1, 2) if with_labels else 1
+        self.v_h = 1
+        self.e_w = 4
+        self.e_h = 2
+        self.bend_offsets = {}
+        self.dcel = None
+        self.rect_edges = []
+
+        self.root = self.pick_root(tree)
+        self.children = self.orient(tree)
+        self.pos = self.layout()
+        self.G = Graph()
+        self.ori_edges = []
+        self.route()
+        self.pos_nodes = list(self.pos)
+        self.pos_array = np.array(list(self.pos.values()), dtype=np.int64).reshape(-1, 2)
+
+    def label(self, v):
+        return node_label(self.vertex_labels, v)
+
+    @staticmethod
+    def pick_root(tree):
+        """
+        The middle of a longest path, found with two bfs passes, for the fewest rows. A path hangs from an end
+        instead, which puts it on a single row.
+        """
+        def farthest(source):
+            parent = {source: None}
+            queue = deque([source])
+            while queue:
+                v = queue.popleft()
+                for u in tree[v]:
+                    if u not in parent:
+                        parent[u] = v
+                        queue.append(u)
+            return v, parent
+
+        end, _ = farthest(next(iter(tree.nodes())))
+        if max(degree for _, degree in tree.degree()) <= 2:
+            return end
+        other, parent = farthest(end)
+        path = [other]
+        while parent[path[-1]] is not None:
+            path.append(parent[path[-1]])
+        return path[len(path) // 2]
+
+    def orient(self, tree):
+        """children of every vertex, in adjacency order, and the vertices in bfs order from the root"""
+        children = {self.root: []}
+        self.order = [self.root]
+        for v in self.order:
+            for u in tree[v]:
+                if u not in children:
+                    children[u] = []
+                    children[v].append(u)
+                    self.order.append(u)
+        return children
+
+    def layout(self):
+        """pos of every vertex, x from the packed contours, y from the row"""
+        sep = 2 * self.v_w + self.e_w
+        step = 2 * self.v_h + self.e_h
+        offset = {}  # pos of every vertex relative to its parent
+        contours = {}  # vertex: (left, right, base), x of the outermost vertex per row relative to base, deepest first
+
+        for v in reversed(self.order):
+            children = self.children[v]
+            if not children:
+                contours[v] = ([0], [0], 0)
+                continue
+            if len(children) == 1:
+                # the row of the child reaches left to v now
+                left, right, base = contours.pop(children[0])
+                left[-1] = -base - sep
+                offset[children[0]] = (sep, 0)
+                contours[v] = (left, right, base + sep)
+                continue
+            left, right, base = contours.pop(children[0])
+            shifts = [0]  # of every child relative to the first
+            for c in children[1:]:
+                c_left, c_right, c_base = contours.pop(c)
+                shared = min(len(right), len(c_left))
+                shift = max(right[-1 - d] + base - c_left[-1 - d] - c_base for d in range(shared)) + sep
+                shifts.append(shift)
+                c_base += shift
+                if len(c_left) >= len(left):
+                    # the new subtree is deeper, its lists go on with the left side of the others written over
+                    for d in range(len(left)):
+                        c_left[-1 - d] = left[-1 - d] + base - c_base
+                    left, right, base = c_left, c_right, c_base
+                else:
+                    for d in range(len(c_right)):
+                        right[-1 - d] = c_right[-1 - d] + c_base - base
+            x = (shifts[0] + shifts[-1]) // 2
+            if x in shifts:
+                # the line down from v would cross the bus into the drop of a child, move it aside
+                x += self.v_w + 1
+            for c, shift in zip(children, shifts):
+                offset[c] = (shift - x, step)
+            left.append(x - base)
+            right.append(x - base)
+            contours[v] = (left, right, base - x)
+
+        pos = {self.root: (0, 0)}
+        for v in self.order:
+            x, y = pos[v]
+            for c in self.children[v]:
+                dx, dy = offset[c]
+                pos[c] = (x + dx, y + dy)
+        return pos
+
+    def route(self):
+        """the bus of every parent, as segments between its vertices and bends"""
+        b_cnt = 0
+        mid = self.v_h + self.e_h // 2
+        for v in self.order:
+            children = self.children[v]
+            if not children:
+                continue
+            x, y = self.pos[v]
+            if len(children) == 1:
+                self.add_segment(v, children[0])
+                continue
+            hub = (Kind.BEND, b_cnt)
+            b_cnt += 1
+            self.pos[hub] = (x, y + mid)
+            self.add_segment(v, hub)
+            bus = {x: hub}
+            for c in children:
+                cx = self.pos[c][0]
+                bend = (Kind.BEND, b_cnt)
+                b_cnt += 1
+                self.pos[bend] = (cx, y + mid)
+                self.add_segment(bend, c)
+                bus[cx] = bend
+            points = [bus[cx] for cx in sorted(bus)]
+            for a, b in zip(points, points[1:]):
+                self.add_segment(a, b)
+
+    def add_segment(self, a, b):
+        self.G.add_edge(a, b)
+        self.ori_edges.append((a, b))
@@ -1,33 +1,39 @@
+import io
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import repeat
 from timeit import default_timer as timer
 
 import networkx as nx
 
+from .cache import RenderCache, component_key
 from .compaction import Compaction
-from .display import Display
+from .display import Display, get_charset
+from .layout_cache import LayoutCache
 from .orthogonalize import Orthogonalize
 from .planarize import Planarize
 from .preprocess import Preprocess
 from .rectangularize import Rectangularize
 from .simplify import Simplify
+from .tree_layout import TreeLayout, is_tree
 
 
-def to_ascii(graph: nx.Graph, verbose=False, with_labels=False):
+def to_ascii(graph: nx.Graph, verbose=False, with_labels=False, workers=1, charset='heavy',
+             cache: RenderCache = None, layouts: LayoutCache = None, contract=False):
+    """
+    charset is 'heavy', 'light', 'double', 'ascii' or a custom 16 character string, see display.CHARSETS.
+    workers > 1 (or None, for one worker per cpu) renders the connected components on a process pool. Output is
+    always concatenated in component order. A single component uses the workers for compaction instead, on a pool
+    started once per call.
+    With a RenderCache, components already drawn before are looked up instead of laid out again. With a LayoutCache,
+    components isomorphic to one laid out before reuse its layout, and components are drawn one at a time.
+    contract draws paths of degree 2 vertices as single edges until compaction, for much smaller problems on sparse
+    graphs, see Simplify.contract_chains.
+    Trees skip the pipeline for TreeLayout, in linear time, whatever the other options.
+    """
     start = timer()
-    out = ""
-    for component in [graph.subgraph(c) for c in nx.connected_components(graph)]:
-        if nx.number_of_nodes(component) == 1:
-            single_node = list(component.nodes())[0]
-            out += handle_degenerate(single_node, with_labels)
-            continue
-        processed = Preprocess(component)
-        simplified = Simplify(processed)
-        planarized = Planarize(simplified)
-        orthogonalized = Orthogonalize(planarized)
-        rectangularized = Rectangularize(orthogonalized)
-        compacted = Compaction(rectangularized, with_labels=with_labels)
-        display = Display(compacted, with_labels=with_labels)
-        out += display.build_output()
-
+    out = "".join(iter_ascii(graph, with_labels=with_labels, workers=workers, charset=charset, cache=cache,
+                             layouts=layouts, contract=contract))
     end = timer()
 
     if verbose:
@@ -38,9 +44,111 @@ def to_ascii(graph: nx.Graph, verbose=False, with_labels=False):
     return out
 
 
-def handle_degenerate(vertex_id, with_labels=False):
-    if with_labels:
-        vertex_id = str(vertex_id)
-        return f"┏━{'━' * len(vertex_id)}━┓\n┃ {vertex_id} ┃\n┗━{'━' * len(vertex_id)}━┛\n"
-    else:
-        return f"┏━━━┓\n┃   ┃\n┗━━━┛\n"
+def write_ascii(graph: nx.Graph, file, with_labels=False, workers=1, charset='heavy', encoding='utf-8',
+                cache: RenderCache = None, layouts: LayoutCache = None, contract=False, errors='strict'):
+    """
+    Streams the drawing of to_ascii into a text file-like object, or a binary one (e.g. socket.makefile('wb')) as
+    encoded bytes, component by component. errors is handled as in str.encode, so by default a character the
+    encoding can not represent raises UnicodeEncodeError rather than changing the drawing.
+    """
+    binary = not isinstance(file, io.TextIOBase)
+    for line in iter_ascii(graph, with_labels=with_labels, workers=workers, charset=charset,
+                           encoding=encoding if binary else None, cache=cache, layouts=layouts,
+                           contract=contract, errors=errors):
+        file.write(line)
+
+
+def iter_ascii(graph: nx.Graph, with_labels=False, workers=1, charset='heavy', encoding=None,
+               cache: RenderCache = None, layouts: LayoutCache = None, contract=False, errors='strict'):
+    """
+    Yields the drawing of to_ascii line by line, each ending with a line break (as bytes if encoding is given, with
+    errors as in str.encode). Only the canvas of the component being written is kept in memory, unless it goes into
+    the cache.
+    """
+    components = [graph.subgraph(c) for c in nx.connected_components(graph)]
+    pending = [component for component in components if nx.number_of_nodes(component) > 1]
+
+    def lines(text):
+        for line in text.splitlines(keepends=True):
+            yield line if encoding is None else line.encode(encoding, errors)
+
+    if (workers is None or workers > 1) and len(pending) > 1 and layouts is None:
+        # look everything up front, so only misses go to the pool, and equal components are rendered once
+        keys = [component_key(component, with_labels, charset, contract) if cache is not None else i
+                for i, component in enumerate(pending)]
+        texts = {}
+        for key in keys:
+            if cache is not None:
+                texts[key] = cache.get(key)
+        missing = list(dict.fromkeys(key for key, component in zip(keys, pending) if texts.get(key) is None))
+        to_render = {key: component for key, component in zip(keys, pending) if key in missing}
+        # when every component is a cache hit no workers are started at all
+        with ProcessPoolExecutor(max_workers=workers) if missing else nullcontext() as pool:
+            results = iter(())
+            if missing:
+                results = pool.map(render_component, [to_render[key].copy() for key in missing], repeat(with_labels),
+                                   repeat(None), repeat(charset), repeat(None), repeat(contract))
+            keys = iter(keys)
+            for component in components:
+                if nx.number_of_nodes(component) == 1:
+                    yield from lines(handle_degenerate(next(iter(component.nodes())), with_labels, charset))
+                    continue
+                key = next(keys)
+                if texts.get(key) is None:
+                    texts[key] = next(results)
+                    if cache is not None:
+                        cache.put(key, texts[key])
+                yield from lines(texts[key])
+        return
+
+    # a single component, or one at a time with a LayoutCache, uses the workers for compaction, on a pool started
+    # once for the whole call
+    with ProcessPoolExecutor(max_workers=workers) if workers is None or workers > 1 else nullcontext() as executor:
+        for component in components:
+            if nx.number_of_nodes(component) == 1:
+                yield from lines(handle_degenerate(next(iter(component.nodes())), with_labels, charset))
+                continue
+            if cache is not None:
+                key = component_key(component, with_labels, charset, contract)
+                text = cache.get(key)
+                if text is None:
+                    text = render_component(component, with_labels, executor, charset, layouts, contract)
+                    cache.put(key, text)
+                yield from lines(text)
+                continue
+            display = build_display(component, with_labels, executor, charset, layouts, contract)
+            if encoding is None:
+                for row in display.rows():
+                    yield row + "\n"
+            else:
+                yield from display.encoded_rows(encoding, errors)
+            del display
+
+
+def render_component(component: nx.Graph, with_labels=False, executor: Executor = None, charset='heavy',
+                     layouts: LayoutCache = None, contract=False):
+    return build_display(component, with_labels, executor, charset, layouts, contract).build_output()
+
+
+def build_display(component: nx.Graph, with_labels=False, executor: Executor = None, charset='heavy',
+                  layouts: LayoutCache = None, contract=False):
+    if is_tree(component):
+        return Display(TreeLayout(Preprocess(component), with_labels), with_labels=with_labels, charset=charset)
+    if layouts is not None:
+        compacted = layouts.compaction(component, with_labels, executor, contract)
+        return Display(compacted, with_labels=with_labels, charset=charset)
+    processed = Preprocess(component)
+    simplified = Simplify(processed, contract)
+    planarized = Planarize(simplified)
+    orthogonalized = Orthogonalize(planarized)
+    rectangularized = Rectangularize(orthogonalized)
+    compacted = Compaction(rectangularized, with_labels=with_labels, executor=executor)
+    return Display(compacted, with_labels=with_labels, charset=charset)
+
+
+def handle_degenerate(vertex_id, with_labels=False, charset='heavy'):
+    chars = get_charset(charset)
+    label = str(vertex_id) if with_labels else " "
+    return (f"{chars[12]}{chars[10]}{chars[10] * len(label)}{chars[10]}{chars[6]}\n"
+            f"{chars[5]} {label} {chars[5]}\n"
+            f"{chars[9]}{chars[10]}{chars[10] * len(label)}{chars[10]}{chars[3]}\n")
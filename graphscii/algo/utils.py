@@ -1,38 +1,67 @@
+import os
+from enum import IntEnum
+
+# GRAPHSCII_DEBUG=1 re-checks invariants between stages (e.g. that planarization left a planar graph), off by default
+DEBUG = os.environ.get('GRAPHSCII_DEBUG', '') not in ('', '0')
+
+
+class Kind(IntEnum):
+    """
+    Kind of a node id (kind, n). Numbered in the order of the names, so sorting node ids orders them as it would by
+    the names of their kinds.
+    """
+    BEND = 0
+    CORNER = 1
+    CROSSING_DUMMY = 2
+    FACE = 3
+    H_AUX_FACE = 4
+    LOOP_DUMMY = 5
+    RECT_DUMMY = 6
+    VERTEX = 7
+    VERTEX_FACE_DUMMY = 8
+
+
+# the members bound once, Kind.X goes through the enum on every lookup
+BEND, CORNER, CROSSING_DUMMY, FACE, H_AUX_FACE, LOOP_DUMMY, RECT_DUMMY, VERTEX, VERTEX_FACE_DUMMY = Kind
+STRUCTURAL = frozenset((LOOP_DUMMY, VERTEX, CROSSING_DUMMY))
+STRUCT_DUMMY = frozenset((LOOP_DUMMY, CROSSING_DUMMY))
+
+
 def v_is_h_aux(vertex):
-    return vertex[0][:5] == 'h_aux'
+    return vertex[0] == H_AUX_FACE
 
 
 def v_is_structural(vertex):
-    return vertex[0] == 'loop_dummy' or vertex[0] == 'vertex' or vertex[0] == 'crossing_dummy'
+    return vertex[0] in STRUCTURAL
 
 
 def v_is_face(vertex):
-    return vertex[0] == 'face'
+    return vertex[0] == FACE
 
 
 def v_is_face_dummy(vertex):
-    return vertex[0] == 'vertex_face_dummy'
+    return vertex[0] == VERTEX_FACE_DUMMY
 
 
 def v_is_struct_dummy(vertex):
-    return vertex[0] == 'loop_dummy' or vertex[0] == 'crossing_dummy'
+    return vertex[0] in STRUCT_DUMMY
 
 
 def v_is_rect_dummy(vertex):
-    return vertex[0] == 'rect_dummy'
+    return vertex[0] == RECT_DUMMY
 
 
 def v_is_crossing_dummy(vertex):
-    return vertex[0] == 'crossing_dummy'
+    return vertex[0] == CROSSING_DUMMY
 
 
 def v_is_corner(vertex):
-    return vertex[0][:6] == 'corner'
+    return vertex[0] == CORNER
 
 
 def v_is_bend(vertex):
-    return vertex[0] == 'bend'
+    return vertex[0] == BEND
 
 
 def v_is_vertex(vertex):
-    return vertex[0] == 'vertex'
+    return vertex[0] == VERTEX
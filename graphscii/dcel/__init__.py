@@ -1 +1,2 @@
 from .dcel import Dcel
+from .graph import Graph
@@ -2,8 +2,10 @@
 It is a data structure to represent an embedding of a planar graph in the plane
 """
 from .face import Face
+from .graph import Graph
 from .halfedge import HalfEdge
 from .vertex import Vertex
+from ..algo.utils import Kind
 
 
 class Dcel:
@@ -12,10 +14,12 @@ class Dcel:
     Require the number of nodes greater than 1.
     Naming vertice with node name.
     Naming halfedge with (u, v).
-    Nmming face with ('face', %d).
+    Nmming face with (Kind.FACE, %d).
+    Keeps self.graph, the plain adjacency of the current vertices and edges, in sync with every edit.
     """
 
     def __init__(self, G, embedding):
+        self.graph = Graph(G.adj)
         self.vertices = {}
         self.half_edges = {}
         self.faces = {}
@@ -42,8 +46,8 @@ class Dcel:
             he.succ.prev = he
 
         for he in self.half_edges.values():
-            if not he.inc:
-                face_id = ("face", len(self.faces))
+            if he.inc is None:
+                face_id = (Kind.FACE, len(self.faces))
                 face = Face(face_id)
                 face.inc = he
                 self.faces[face_id] = face
@@ -51,11 +55,60 @@ class Dcel:
                 nodes_id = embedding.traverse_face(*he.get_points())
                 for v1_id, v2_id in zip(nodes_id, nodes_id[1:] + nodes_id[:1]):
                     other = self.half_edges[v1_id, v2_id]
-                    assert not other.inc
+                    assert other.inc is None
                     other.inc = face
 
         if not self.faces:
-            self.faces[('face', 0)] = Face(('face', 0))
+            self.faces[(Kind.FACE, 0)] = Face((Kind.FACE, 0))
+        self.f_cnt = len(self.faces)  # next id for split_face
+
+    def dual_path(self, u, v):
+        """
+        Shortest path in the planar dual from the faces around vertex u to the faces around vertex v, returned as the
+        list of half-edges crossed on the way (each one's inc is the face being left). The dual is read straight off
+        the face pointers, so face splits from add_node_between/connect_with_he/connect_with_face are always reflected
+        without rebuilding anything. Searched with a level-synchronous bidirectional BFS.
+        """
+        src = {face: (None, 0) for face in self.vertices[u].surround_faces()}  # face: (half-edge crossed in, dist)
+        dst = {face: (None, 0) for face in self.vertices[v].surround_faces()}
+
+        def expand(frontier, seen, other, forward):
+            nxt_frontier, best = [], None
+            for face in frontier:
+                dist = seen[face][1] + 1
+                for he in face.surround_half_edges():
+                    o_face = he.twin.inc
+                    if o_face in seen:
+                        continue
+                    seen[o_face] = (he if forward else he.twin, dist)
+                    nxt_frontier.append(o_face)
+                    if o_face in other and (best is None or other[o_face][1] < other[best][1]):
+                        best = o_face
+            return nxt_frontier, best
+
+        meet = next((face for face in src if face in dst), None)
+        fwd, bwd = list(src), list(dst)
+        while meet is None:
+            if not fwd or not bwd:
+                raise Exception(f"No path between {u} and {v} in the dual")
+            if len(fwd) <= len(bwd):
+                fwd, meet = expand(fwd, src, dst, True)
+            else:
+                bwd, meet = expand(bwd, dst, src, False)
+
+        path = []
+        face = meet
+        while src[face][0] is not None:
+            he = src[face][0]
+            path.append(he)
+            face = he.inc
+        path.reverse()
+        face = meet
+        while dst[face][0] is not None:
+            he = dst[face][0]
+            path.append(he)
+            face = he.twin.inc
+        return path
 
     def add_node_between(self, u, node_name, v):
         def insert_node(u, v, mi):
@@ -86,8 +139,15 @@ class Dcel:
         for v1, v2 in ((u, mi.id), (mi.id, v)):
             self.half_edges[v1, v2].twin = self.half_edges[v2, v1]
             self.half_edges[v2, v1].twin = self.half_edges[v1, v2]
+        self.graph.remove_edge(u, v)
+        self.graph.add_edge(u, node_name)
+        self.graph.add_edge(node_name, v)
 
-    def connect_with_face(self, face: Face, u, v, halfedge_side, side_uv):  # u, v in same face
+    def connect_with_face(self, face: Face, u, v, halfedge_side, side_uv, reuse_face=False):  # u, v in same face
+        """
+        With reuse_face, face object and id stay with the larger of the two faces and only the smaller one is walked,
+        in time linear in its size, to point its half-edges at a new (Kind.FACE, %d).
+        """
         def insert_halfedge(u, v, f, prev_he, succ_he):
             he = HalfEdge((u, v))
             self.half_edges[u, v] = he
@@ -99,14 +159,6 @@ class Dcel:
             for h in he.traverse():
                 h.inc = f
 
-        # It's true only if G is connected.
-        face_l = Face(('face', *face.id[1:], 'l'))
-        face_r = Face(('face', *face.id[1:], 'r'))
-
-        if face.is_external:
-            face_r.is_external = True
-            self.ext_face = face_r
-
         hes_u = [he for he in self.vertices[u].surround_half_edges()
                  if he.inc == face]
         hes_v = [he for he in self.vertices[v].surround_half_edges()
@@ -134,12 +186,60 @@ class Dcel:
         prev_vu = he_v.prev
         succ_vu = he_u
 
+        if reuse_face:
+            self.split_face(face, u, v, prev_uv, succ_uv, prev_vu, succ_vu)
+            return
+
+        # It's true only if G is connected.
+        face_l = Face((Kind.FACE, *face.id[1:], 'l'))
+        face_r = Face((Kind.FACE, *face.id[1:], 'r'))
+
+        if face.is_external:
+            face_r.is_external = True
+            self.ext_face = face_r
+
         insert_halfedge(u, v, face_r, prev_uv, succ_uv)
         insert_halfedge(v, u, face_l, prev_vu, succ_vu)
         self.half_edges[u, v].twin = self.half_edges[v, u]
         self.half_edges[v, u].twin = self.half_edges[u, v]
+        self.graph.add_edge(u, v)
         self.faces.pop(face.id)
 
+    def split_face(self, face: Face, u, v, prev_uv, succ_uv, prev_vu, succ_vu):
+        he_uv, he_vu = HalfEdge((u, v)), HalfEdge((v, u))
+        for he, prev_he, succ_he in ((he_uv, prev_uv, succ_uv), (he_vu, prev_vu, succ_vu)):
+            self.half_edges[he.id] = he
+            he.set(None, self.vertices[he.id[0]], prev_he, succ_he, face)
+            prev_he.succ = he
+            succ_he.prev = he
+        he_uv.twin, he_vu.twin = he_vu, he_uv
+        self.graph.add_edge(u, v)
+
+        # walk both faces in step, the one that is done first gets the new face
+        walk_r, walk_l = he_uv.traverse(), he_vu.traverse()
+        while True:
+            if next(walk_r, None) is None:
+                small, large = he_uv, he_vu
+                break
+            if next(walk_l, None) is None:
+                small, large = he_vu, he_uv
+                break
+        new_face = Face((Kind.FACE, self.f_cnt))
+        self.f_cnt += 1
+        new_face.inc, face.inc = small, large
+        for h in small.traverse():
+            h.inc = new_face
+
+        face_r, face_l = he_uv.inc, he_vu.inc
+        if face.is_external and face_r is new_face:
+            face.is_external = False
+            face_r.is_external = True
+            self.ext_face = face_r
+        # same order as connect_with_face leaves them in
+        self.faces.pop(face.id)
+        self.faces[face_r.id] = face_r
+        self.faces[face_l.id] = face_l
+
     def connect_with_he(self, u, v, succ_uv: HalfEdge, succ_vu: HalfEdge):
         def insert_halfedge(u, v, f, prev_he, succ_he):
             he = HalfEdge((u, v))
@@ -155,8 +255,8 @@ class Dcel:
         assert succ_uv.inc == succ_vu.inc
         face = succ_uv.inc
         # It's true only if G is connected.
-        face_l = Face(('face', *face.id[1:], 'l'))
-        face_r = Face(('face', *face.id[1:], 'r'))
+        face_l = Face((Kind.FACE, *face.id[1:], 'l'))
+        face_r = Face((Kind.FACE, *face.id[1:], 'r'))
 
         if face.is_external:
             face_r.is_external = True
@@ -169,9 +269,11 @@ class Dcel:
         insert_halfedge(v, u, face_l, prev_vu, succ_vu)
         self.half_edges[u, v].twin = self.half_edges[v, u]
         self.half_edges[v, u].twin = self.half_edges[u, v]
+        self.graph.add_edge(u, v)
         self.faces.pop(face.id)
 
-    def connect_diff(self, face: Face, u, v):
+    def connect_diff(self, face: Face, u, v, he_u: HalfEdge = None):
+        """he_u picks the outgoing half-edge of u to insert before, needed when u appears on face more than once"""
         assert type(u) != Vertex
         assert type(v) != Vertex
 
@@ -182,7 +284,8 @@ class Dcel:
             prev_he.succ = he
             succ_he.prev = he
 
-        he_u = self.vertices[u].get_half_edge(face)
+        if he_u is None:
+            he_u = self.vertices[u].get_half_edge(face)
         he_v = self.vertices[v].get_half_edge(face)
         prev_uv = he_u.prev
         succ_uv = he_v
@@ -193,3 +296,4 @@ class Dcel:
         insert_halfedge(v, u, face, prev_vu, succ_vu)
         self.half_edges[u, v].twin = self.half_edges[v, u]
         self.half_edges[v, u].twin = self.half_edges[u, v]
+        self.graph.add_edge(u, v)
@@ -1,4 +1,6 @@
 class Face:
+    __slots__ = ('id', 'inc', 'is_external')
+
     def __init__(self, name):
         self.id = name
         self.inc = None  # the first half-edge incident to the face from left
@@ -15,11 +17,8 @@ class Face:
             yield he.twin.inc
 
     def surround_half_edges(self):  # clockwise
-        yield from self.inc.traverse()
+        return self.inc.traverse()
 
     def surround_vertices(self):
         for he in self.surround_half_edges():
             yield he.ori
-
-    def __hash__(self):
-        return hash(self.id)
@@ -0,0 +1,61 @@
+import networkx as nx
+
+
+class Graph:
+    """
+    Plain adjacency dict of neighbor dicts, kept in the same insertion order networkx would keep, so iterating
+    nodes and edges gives the same order as the networkx graph it replaces. The Dcel owns one and updates it on
+    every edit, stages only read from it.
+    """
+    __slots__ = ('adj',)
+
+    def __init__(self, adj=None):
+        self.adj = {u: dict.fromkeys(nbrs) for u, nbrs in (adj or {}).items()}
+
+    def __getitem__(self, node):
+        return self.adj[node]
+
+    def __contains__(self, node):
+        return node in self.adj
+
+    def nodes(self):
+        return iter(self.adj)
+
+    def edges(self):
+        seen = set()
+        for u, nbrs in self.adj.items():
+            for v in nbrs:
+                if v not in seen:
+                    yield u, v
+            seen.add(u)
+
+    def degree(self, node):
+        return len(self.adj[node])
+
+    def has_edge(self, u, v):
+        return u in self.adj and v in self.adj[u]
+
+    def add_node(self, node):
+        self.adj.setdefault(node, {})
+
+    def add_edge(self, u, v):
+        self.adj.setdefault(u, {})[v] = None
+        self.adj.setdefault(v, {})[u] = None
+
+    def add_edges_from(self, edges):
+        for u, v in edges:
+            self.add_edge(u, v)
+
+    def remove_edge(self, u, v):
+        try:
+            del self.adj[u][v]
+            if u != v:
+                del self.adj[v][u]
+        except KeyError:
+            raise Exception(f"Edge {u}-{v} not in graph")
+
+    def to_networkx(self):
+        G = nx.Graph()
+        G.add_nodes_from(self.adj)
+        G.add_edges_from(self.edges())
+        return G
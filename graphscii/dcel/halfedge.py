@@ -1,4 +1,6 @@
 class HalfEdge:
+    __slots__ = ('id', 'inc', 'twin', 'ori', 'prev', 'succ')
+
     def __init__(self, name):
         self.id = name
         self.inc = None  # the incident face at its right hand
@@ -26,6 +28,3 @@ class HalfEdge:
 
     def __repr__(self) -> str:
         return f'he({self.ori}->{self.twin.ori})'
-
-    def __hash__(self):
-        return hash(self.id)
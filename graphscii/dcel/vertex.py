@@ -1,4 +1,6 @@
 class Vertex:
+    __slots__ = ('id', 'inc')
+
     def __init__(self, name):
         self.id = name
         self.inc = None  # 'the first outgoing incident half-edge'
@@ -22,6 +24,3 @@ class Vertex:
 
     def __repr__(self):
         return f'v({self.id})'
-
-    def __hash__(self):
-        return hash(self.id)
@@ -1,17 +1,28 @@
+import io
+import itertools
+import tempfile
 import unittest
+from unittest import mock
+from concurrent.futures import ProcessPoolExecutor
 import networkx as nx
+import numpy as np
 from timeit import default_timer as timer
 
 from networkx.generators.harary_graph import hnm_harary_graph
 
-from graphscii import to_ascii
+from graphscii import LayoutCache, LayoutSession, RenderCache, iter_ascii, to_ascii, write_ascii
+from graphscii.algo import face_turns
 from graphscii.algo.compaction import Compaction
 from graphscii.algo.display import Display
+from graphscii.algo.flow_solver import CbcSolver, FlowSolver, NetworkSimplexSolver
 from graphscii.algo.rectangularize import Rectangularize
 from graphscii.algo.orthogonalize import Orthogonalize
 from graphscii.algo.planarize import Planarize
 from graphscii.algo.preprocess import Preprocess
 from graphscii.algo.simplify import Simplify
+from graphscii.algo.tree_layout import TreeLayout
+from graphscii.algo.utils import Kind, v_is_h_aux, v_is_vertex
+from graphscii.dcel.halfedge import HalfEdge
 
 
 class PlanarizeGraph(unittest.TestCase):
@@ -22,7 +33,7 @@ class PlanarizeGraph(unittest.TestCase):
             processed = Preprocess(component)
             simplified = Simplify(processed)
             planarized = Planarize(simplified)
-            self.assertTrue(nx.is_planar(planarized.G))
+            self.assertTrue(nx.is_planar(planarized.G.to_networkx()))
 
     def test_planarize_random_graph(self):
         graph = nx.gnp_random_graph(20, 0.5)
@@ -31,7 +42,36 @@ class PlanarizeGraph(unittest.TestCase):
             processed = Preprocess(component)
             simplified = Simplify(processed)
             planarized = Planarize(simplified)
-            self.assertTrue(nx.is_planar(planarized.G))
+            self.assertTrue(nx.is_planar(planarized.G.to_networkx()))
+
+    def test_maximal_planar_subgraph_k_10(self):
+        graph = nx.complete_graph(10)
+        processed = Preprocess(graph)
+        simplified = Simplify(processed)
+        planarized = Planarize(simplified)
+        crossed = set(planarized.edges_to_add)
+        subgraph = nx.Graph([edge for edge in planarized.ori_edges if edge not in crossed])
+        self.assertTrue(nx.is_planar(subgraph))
+        self.assertEqual(nx.number_of_edges(subgraph), 3 * 10 - 6)
+        for u, v in crossed:
+            self.assertFalse(nx.is_planar(nx.Graph(list(subgraph.edges()) + [(u, v)])))
+
+    def test_dual_path_petersen_graph(self):
+        graph = nx.petersen_graph()
+        processed = Preprocess(graph)
+        simplified = Simplify(processed)
+        planarized = Planarize(simplified)
+        dcel = planarized.dcel
+        for u, v in itertools.combinations(dcel.vertices, 2):
+            path = dcel.dual_path(u, v)
+            shared = set(dcel.vertices[u].surround_faces()) & set(dcel.vertices[v].surround_faces())
+            self.assertEqual(len(path) == 0, len(shared) > 0)
+            if not path:
+                continue
+            self.assertIn(path[0].inc, list(dcel.vertices[u].surround_faces()))
+            self.assertIn(path[-1].twin.inc, list(dcel.vertices[v].surround_faces()))
+            for a, b in zip(path, path[1:]):
+                self.assertIs(a.twin.inc, b.inc)
 
 
 class OrthogonalizeGraph(unittest.TestCase):
@@ -48,6 +88,70 @@ class OrthogonalizeGraph(unittest.TestCase):
         planarized = Planarize(simplified)
         orthogonalized = Orthogonalize(planarized)
 
+    def test_orthogonalize_helpers_only_for_high_degree(self):
+        graph = nx.star_graph(5)
+        processed = Preprocess(graph)
+        simplified = Simplify(processed)
+        planarized = Planarize(simplified)
+        orthogonalized = Orthogonalize(planarized)
+        self.assertEqual(orthogonalized.model_size['bundles'], 5)
+        helper_vertices = {v[1][0] for v in orthogonalized.flow_model.nodes if v_is_h_aux(v)}
+        self.assertEqual(helper_vertices, {(Kind.VERTEX, 0)})
+
+    def test_orthogonalize_solvers_agree(self):
+        for graph in [nx.petersen_graph(), nx.complete_graph(7), nx.hypercube_graph(3)]:
+            bends = []
+            for solver in ['network', 'cbc']:
+                processed = Preprocess(graph)
+                simplified = Simplify(processed)
+                planarized = Planarize(simplified)
+                orthogonalized = Orthogonalize(planarized, solver=solver)
+                bends.append(sum(len(bend_list) for bend_list in orthogonalized.bend_dict.values()))
+            self.assertEqual(bends[0], bends[1])
+
+    def test_orthogonalize_flow_model_is_conserved(self):
+        processed = Preprocess(nx.complete_graph(6))
+        simplified = Simplify(processed)
+        planarized = Planarize(simplified)
+        orthogonalized = Orthogonalize(planarized)
+        model = orthogonalized.flow_model
+        for solver in [CbcSolver(), NetworkSimplexSolver()]:
+            flow = solver.solve(model)
+            self.assertTrue(np.array_equal(model.incidence() @ flow, model.demand))
+            self.assertTrue(np.all(flow[model.bundles].sum(axis=1) <= 1))
+
+    def test_orthogonalize_warm_start(self):
+        processed = Preprocess(nx.complete_graph(7))
+        simplified = Simplify(processed)
+        planarized = Planarize(simplified)
+        orthogonalized = Orthogonalize(planarized)
+        snapshot = orthogonalized.snapshot()
+        bends = sum(len(bend_list) for bend_list in orthogonalized.bend_dict.values())
+        rotation, ext = planarized.rotation()
+
+        # every face is known, so the whole flow is kept
+        warm = Orthogonalize(Planarize.from_rotation(rotation, ext, planarized.vertex_labels, planarized.d_cnt),
+                             warm_start=snapshot)
+        self.assertEqual(warm.snapshot(), snapshot)
+        # a flow that fits nowhere is dropped for a full solve
+        wrong = {arc: 3 for arc in snapshot}
+        cold = Orthogonalize(Planarize.from_rotation(rotation, ext, planarized.vertex_labels, planarized.d_cnt),
+                             warm_start=wrong)
+        self.assertEqual(sum(len(bend_list) for bend_list in cold.bend_dict.values()), bends)
+
+    def test_flow_solver_is_abstract(self):
+        with self.assertRaises(TypeError):
+            FlowSolver()
+
+    def test_orthogonalize_low_degree_skips_ilp(self):
+        for graph in [nx.cycle_graph(6), nx.hypercube_graph(3), nx.petersen_graph(), nx.grid_2d_graph(6, 6)]:
+            processed = Preprocess(graph)
+            simplified = Simplify(processed)
+            planarized = Planarize(simplified)
+            orthogonalized = Orthogonalize(planarized, solver='cbc')
+            self.assertFalse(orthogonalized.is_kandinsky)
+            self.assertFalse(any(v[0] == 'h_aux_face' for v in orthogonalized.flow_model.nodes))
+
 
 class RectangularizeGraph(unittest.TestCase):
     def test_compact_k_5(self):
@@ -106,8 +210,91 @@ class RectangularizeGraph(unittest.TestCase):
         orthogonalized = Orthogonalize(planarized)
         compacted = Rectangularize(orthogonalized)
 
+    def test_rectangularize_long_outer_face(self):
+        # a comb is a single face, every tooth puts two reflex turns on it
+        def comb(n):
+            graph = nx.path_graph(n)
+            graph.add_edges_from((i, n + i) for i in range(n))
+            return Orthogonalize(Planarize(Simplify(Preprocess(graph))))
+
+        # face walks and treap updates, a quadratic refinement makes about 16 times as many on 4 times the teeth
+        traverse, pull = HalfEdge.traverse, face_turns.pull
+        steps = []
+
+        def counted_traverse(he):
+            for h in traverse(he):
+                steps[-1] += 1
+                yield h
+
+        def counted_pull(node):
+            steps[-1] += 1
+            pull(node)
+
+        for n in [1000, 4000]:
+            orthogonalized = comb(n)
+            steps.append(0)
+            with mock.patch.object(HalfEdge, 'traverse', counted_traverse), \
+                    mock.patch.object(face_turns, 'pull', counted_pull):
+                rectangularized = Rectangularize(orthogonalized)
+            for face in rectangularized.dcel.faces.values():
+                if face.id == (Kind.FACE, -1) or face in rectangularized.triangle_faces:
+                    continue
+                for he in face.surround_half_edges():
+                    turn = (rectangularized.side_dict[he.succ] - rectangularized.side_dict[he]) % 4
+                    self.assertIn(turn, (0, 1))
+        self.assertLess(steps[1], 6 * steps[0])
+
 
 class CompactGraph(unittest.TestCase):
+    def test_compact_parallel_axes(self):
+        graph = nx.grid_2d_graph(6, 6)
+        processed = Preprocess(graph)
+        simplified = Simplify(processed)
+        planarized = Planarize(simplified)
+        orthogonalized = Orthogonalize(planarized)
+        rectangularized = Rectangularize(orthogonalized)
+        serial = Compaction(rectangularized)
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            parallel = Compaction(rectangularized, executor=executor)
+        self.assertEqual(serial.pos, parallel.pos)
+
+    def test_compact_warm_start(self):
+        processed = Preprocess(nx.complete_graph(7))
+        simplified = Simplify(processed)
+        planarized = Planarize(simplified)
+        rotation, ext = planarized.rotation()
+
+        def redraw(warm_start):
+            drawn = Planarize.from_rotation(rotation, ext, planarized.vertex_labels, planarized.d_cnt)
+            return Compaction(Rectangularize(Orthogonalize(drawn)), warm_start=warm_start)
+
+        cold = redraw(None)
+        snapshot = cold.snapshot()
+        total = sum(cold.length_dict.values())
+
+        # bends and rect dummies are made in the same places, so every length is found again and kept
+        self.assertEqual(redraw(snapshot).snapshot(), snapshot)
+        # any start is fine, only the optimum is found from further away
+        self.assertEqual(sum(redraw({key: 1000 for key in snapshot}).length_dict.values()), total)
+        self.assertEqual(sum(redraw({}).length_dict.values()), total)
+
+    def test_compact_longest_path_matches_layout(self):
+        directions = {0: (0, 1), 1: (1, 0), 2: (0, -1), 3: (-1, 0)}
+        for graph in [nx.complete_graph(5), nx.petersen_graph(), nx.grid_2d_graph(4, 4)]:
+            processed = Preprocess(graph)
+            simplified = Simplify(processed)
+            planarized = Planarize(simplified)
+            orthogonalized = Orthogonalize(planarized)
+            rectangularized = Rectangularize(orthogonalized)
+            compacted = Compaction(rectangularized, method='longest_path')
+            pos = compacted.layout()
+            for he, side in compacted.side_dict.items():
+                length = compacted.length_dict[he]
+                if he not in compacted.triangle_edges:
+                    self.assertGreater(length, 0)
+                (x1, y1), (x2, y2) = pos[he.ori.id], pos[he.twin.ori.id]
+                self.assertEqual((x2 - x1, y2 - y1), tuple(d * length for d in directions[side]))
+
     def test_compact_k_5(self):
         graph = nx.complete_graph(5)
         processed = Preprocess(graph)
@@ -223,11 +410,197 @@ class DisplayGraph(unittest.TestCase):
         print(f'Took total of {end - start} seconds')
 
 
+    def test_encoded_rows(self):
+        graph = nx.petersen_graph()
+        processed = Preprocess(graph)
+        simplified = Simplify(processed)
+        planarized = Planarize(simplified)
+        orthogonalized = Orthogonalize(planarized)
+        rectangularized = Rectangularize(orthogonalized)
+        compacted = Compaction(rectangularized)
+        for charset, encoding in [('heavy', 'utf-8'), ('ascii', 'ascii')]:
+            display = Display(compacted, charset=charset)
+            self.assertEqual(b"".join(display.encoded_rows(encoding)), display.build_output().encode(encoding))
+        display = Display(compacted)
+        with self.assertRaises(UnicodeEncodeError):
+            b"".join(display.encoded_rows('ascii'))
+        self.assertEqual(b"".join(display.encoded_rows('ascii', errors='replace')),
+                         display.build_output().encode('ascii', errors='replace'))
+
 class TestProcess(unittest.TestCase):
     def test_process(self):
         graph = nx.gnp_random_graph(15, 0.5)
         print(to_ascii(graph, with_labels=True))
 
+    def test_process_parallel(self):
+        graph = nx.disjoint_union_all([nx.complete_graph(5), nx.empty_graph(1), nx.cycle_graph(6), nx.star_graph(4)])
+        self.assertEqual(to_ascii(graph, with_labels=True, workers=2), to_ascii(graph, with_labels=True))
+
+
+    def test_process_charsets(self):
+        graph = nx.disjoint_union(nx.petersen_graph(), nx.empty_graph(1))
+        heavy = to_ascii(graph, with_labels=True)
+        for charset in ['light', 'double', 'ascii']:
+            out = to_ascii(graph, with_labels=True, charset=charset)
+            self.assertEqual([len(line) for line in out.split("\n")], [len(line) for line in heavy.split("\n")])
+        self.assertTrue(to_ascii(graph, with_labels=True, charset='ascii').isascii())
+
+    def test_process_streaming(self):
+        graph = nx.disjoint_union_all([nx.complete_graph(5), nx.empty_graph(1), nx.cycle_graph(6)])
+        out = to_ascii(graph, with_labels=True)
+        self.assertEqual(list(iter_ascii(graph, with_labels=True)), out.splitlines(keepends=True))
+        text, binary = io.StringIO(), io.BytesIO()
+        write_ascii(graph, text, with_labels=True)
+        write_ascii(graph, binary, with_labels=True, workers=2)
+        self.assertEqual(text.getvalue(), out)
+        self.assertEqual(binary.getvalue(), out.encode('utf-8'))
+        with self.assertRaises(UnicodeEncodeError):
+            list(iter_ascii(graph, encoding='ascii'))
+
+    def test_process_user_labels(self):
+        graph = nx.relabel_nodes(nx.cycle_graph(4), {0: 'north', 1: (1, 2), 2: 'x', 3: 33})
+        out = to_ascii(graph, with_labels=True)
+        for label in ['north', '(1, 2)', ' x ', '33']:
+            self.assertIn(label, out)
+
+    def test_process_render_cache(self):
+        graph = nx.disjoint_union_all([nx.complete_graph(5), nx.cycle_graph(6), nx.complete_graph(5)])
+        out = to_ascii(graph)
+        with tempfile.TemporaryDirectory() as path:
+            cache = RenderCache(maxsize=1, path=path)
+            self.assertEqual(to_ascii(graph, cache=cache), out)
+            # the cycle evicts the first k5 from memory, so the second one is read back from disk
+            self.assertEqual(cache.info(), (1, 1, 2, 1, 1))
+            self.assertEqual(to_ascii(graph, cache=cache), out)
+            self.assertEqual(cache.info(), (4, 3, 2, 1, 1))
+            shared = RenderCache(path=path)
+            relabelled = nx.relabel_nodes(nx.complete_graph(5), {i: str(i) * 3 for i in range(5)})
+            self.assertEqual(to_ascii(relabelled, cache=shared), to_ascii(nx.complete_graph(5)))
+            self.assertEqual(shared.info().disk_hits, 1)
+            self.assertNotEqual(to_ascii(relabelled, with_labels=True, cache=shared),
+                                to_ascii(nx.complete_graph(5), with_labels=True, cache=shared))
+            self.assertEqual(shared.info().misses, 2)
+
+    def test_process_render_cache_hits_start_no_pool(self):
+        graph = nx.disjoint_union_all([nx.complete_graph(5), nx.cycle_graph(6)])
+        cache = RenderCache()
+        out = to_ascii(graph, cache=cache, workers=2)
+        with mock.patch('graphscii.algo.tsm.ProcessPoolExecutor', side_effect=AssertionError("pool started")):
+            self.assertEqual(to_ascii(graph, cache=cache, workers=2), out)
+
+    def test_process_layout_cache(self):
+        graph = nx.disjoint_union_all([nx.petersen_graph(), nx.cycle_graph(5), nx.petersen_graph()])
+        layouts = LayoutCache()
+        self.assertEqual(to_ascii(graph, with_labels=True, layouts=layouts), to_ascii(graph, with_labels=True))
+        self.assertEqual(layouts.info(), (1, 2, 64, 2))
+        # shuffled and relabelled, still drawn from the same layout, with boxes wide enough for the new labels
+        nodes = list(range(10))
+        nodes.reverse()
+        relabelled = nx.relabel_nodes(nx.petersen_graph(), {v: f"node {i}" for i, v in enumerate(nodes)})
+        out = to_ascii(relabelled, with_labels=True, layouts=layouts)
+        self.assertEqual(layouts.info().hits, 2)
+        for i in range(10):
+            self.assertIn(f"node {i}", out)
+
+    def test_process_layout_session(self):
+        graph = nx.disjoint_union(nx.cycle_graph(6), nx.complete_graph(4))
+        session = LayoutSession(graph, with_labels=True)
+        self.assertEqual(session.render(), to_ascii(graph, with_labels=True))
+        k4 = session.layouts[6]
+        k4_text = k4.text
+
+        for u, v in [(0, 3), (1, 4), (2, 5)]:  # k3,3, the last chord has to cross
+            session.add_edge(u, v)
+        out = session.render()
+        self.assertIs(session.layouts[6], k4)
+        self.assertEqual(k4.text, k4_text)
+        self.assertIn(k4_text, out)
+        self.assertEqual(len(session.layouts[0].rotation), 7)
+
+        session.remove_edge(0, 3)
+        session.remove_edge(1, 4)  # the crossing goes with them
+        self.assertEqual(len(session.layouts[0].rotation), 6)
+        session.remove_node(2)
+        session.add_edge('new', 5)
+        session.add_edge(9, 0)  # joins both components
+        out = session.render()
+        for v in session.graph.nodes():
+            self.assertIn(str(v), out)
+        self.assertIs(session.layouts['new'], session.layouts[6])
+
+        session.relayout()
+        self.assertEqual(session.render(), to_ascii(session.graph, with_labels=True))
+        with LayoutSession(session.graph, with_labels=True, workers=2) as parallel:
+            self.assertEqual(parallel.render(), session.render())
+            self.assertIsNotNone(parallel.executor)
+        self.assertIsNone(parallel.executor)
+
+    def test_process_layout_session_redraw(self):
+        # refine_zero used to merge into a bend another vertex needed for its own 0 degree angle on these frames
+        cases = [
+            (nx.gnp_random_graph(14, 0.3, seed=38),
+             [[('add_edge', 5, 100), ('add_edge', 5, 101)], [('remove_edge', 5, 13)], [('remove_node', 12)],
+              [('remove_edge', 5, 100)]]),
+            (nx.gnp_random_graph(13, 0.5, seed=10),
+             [[('add_edge', 7, 100)], [('remove_node', 10)], [('add_edge', 12, 102)], [('add_edge', 102, 2)],
+              [('add_edge', 11, 4)], [('remove_edge', 1, 12)], [('remove_node', 3)]]),
+        ]
+        for graph, frames in cases:
+            session = LayoutSession(graph)
+            session.render()
+            for frame in frames:
+                for edit, *nodes in frame:
+                    getattr(session, edit)(*nodes)
+                layout = session.layouts[0]
+                out = session.render()
+                # redrawn from the kept embedding and flow, not laid out anew
+                self.assertIs(session.layouts[0], layout)
+                self.assertTrue(layout.flow)
+                self.assertIn(layout.text, out)
+
+    def test_process_tree(self):
+        graph = nx.random_labeled_tree(500, seed=1)
+        graph.add_edges_from((0, f"leaf {i}") for i in range(12))
+        layout = TreeLayout(Preprocess(graph), with_labels=True)
+        self.assertEqual(to_ascii(graph, with_labels=True), Display(layout, with_labels=True).build_output())
+        # boxes of a depth never overlap
+        rows = {}
+        for v, (x, y) in layout.pos.items():
+            if v_is_vertex(v):
+                rows.setdefault(y, []).append(x)
+        for xs in rows.values():
+            xs.sort()
+            self.assertTrue(all(b - a > 2 * layout.v_w for a, b in zip(xs, xs[1:])))
+        # one line up to the parent and one down to all children, whatever the degree
+        self.assertTrue(all(layout.G.degree(v) <= 2 for v in layout.pos if v_is_vertex(v)))
+        out = to_ascii(graph, with_labels=True)
+        for v in graph.nodes():
+            self.assertIn(str(v), out)
+        # boxes as wide as the pipeline's, a path on one row, and only tees on a bus
+        self.assertEqual(len(to_ascii(nx.path_graph(4), with_labels=True).splitlines()), 3)
+        out = to_ascii(nx.star_graph(3), with_labels=True)
+        self.assertIn("┃ 1 ┃", out)
+        self.assertNotIn("╋", out)
+
+    def test_process_contract(self):
+        graph = nx.cycle_graph(8)
+        graph.add_edges_from([(0, 4), (2, 9), (9, 10), (10, 11), (11, 6)])
+        simplified = Simplify(Preprocess(graph), contract=True)
+        self.assertEqual(simplified.G.number_of_nodes(), 4)
+        self.assertEqual(simplified.chains[(Kind.VERTEX, 2), (Kind.VERTEX, 6)], [(Kind.VERTEX, 8), (Kind.VERTEX, 9), (Kind.VERTEX, 10)])
+        out = to_ascii(graph, with_labels=True, contract=True)
+        for v in graph.nodes():
+            self.assertIn(str(v), out)
+        # ends of degree 4 or more keep their neighbor on the chain, a cycle on its own keeps a triangle
+        graph = nx.wheel_graph(5)
+        nx.add_path(graph, [0, 5, 6, 7, 1])
+        simplified = Simplify(Preprocess(graph), contract=True)
+        self.assertEqual(simplified.chains, {((Kind.VERTEX, 5), (Kind.VERTEX, 7)): [(Kind.VERTEX, 6)]})
+        self.assertEqual(Simplify(Preprocess(nx.cycle_graph(6)), contract=True).G.number_of_nodes(), 3)
+        for graph in [graph, nx.cycle_graph(6)]:
+            out = to_ascii(graph, with_labels=True, contract=True)
+            for v in graph.nodes():
+                self.assertIn(str(v), out)
 
 if __name__ == '__main__':
     unittest.main()